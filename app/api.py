@@ -1,11 +1,22 @@
-import pandas as pd
-import io
-from typing import List
-from fastapi import FastAPI, UploadFile, File
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+from functools import partial
+from typing import Iterator, List, Optional
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 
-from app.file_io import parse_zip_archive
-from app.data_validation import validate_series
-from app.ml_inference import PathologyClassifier, model_logger, get_gpu_memory_usage_str
+from app.file_io import DATA_ROOT, resolve_study_path
+from app.study_processing import process_archive, process_study_path, error_row
+from app.jobs import JobManager
+from app.model_client import MODEL_SERVER_URL, load_classifier
+from app.model_state import BackgroundModel
+from app.metrics import render_prometheus, JOB_QUEUE_DEPTH, JOBS
 
 
 app = FastAPI(
@@ -14,59 +25,220 @@ app = FastAPI(
     version="1.0.0"
 )
 
-# Загружаем модель при старте
-model = PathologyClassifier()
+# Прогревать модель фиктивным батчем после загрузки
+WARMUP = os.getenv("MEDSCREEN_WARMUP", "1") == "1"
+# Пауза между попытками дождаться модельного сервера (MEDSCREEN_MODEL_SERVER_URL)
+MODEL_RETRY_S = float(os.getenv("MEDSCREEN_MODEL_RETRY_S", "5"))
+
+# Модель загружается в фоне после старта: API сразу принимает запросы, а готовность
+# видна в /health/ready. Локальная модель (torch импортируется только при загрузке) загружается
+# один раз; модельный сервер API ждет, пока тот не поднимется, без ограничения по времени.
+# До старта модель можно подменить: model_state.model = ... (например, заглушкой в бенчмарках)
+model_state = BackgroundModel(
+    partial(load_classifier, warm_up=WARMUP),
+    retry_interval_s=MODEL_RETRY_S if MODEL_SERVER_URL else None
+)
+
+# Очередь заданий и фоновые воркеры: задания, принятые во время загрузки, ждут ее окончания,
+# а если загрузка не удалась - завершаются со статусом "failed"
+job_manager = JobManager(model_state.wait)
+
+
+@app.on_event("startup")
+def startup():
+    model_state.start()
+    job_manager.start()
+
+
+model_state.add_health_routes(app)
+
+
+# Потоковые форматы ответа /process: параметр stream или заголовок Accept
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def _archive_rows(archives: List[tuple]) -> Iterator[tuple]:
+    """
+    (имя архива, строки, ошибка) по одному архиву из пар (имя, функция обработки):
+    ошибка одного архива не прерывает остальные.
+    """
+    for archive_name, process_one in archives:
+        try:
+            yield archive_name, process_one(), None
+        except Exception as e:
+            logging.getLogger('model_logger').error(f"Ошибка обработки {archive_name}: {e}")
+            yield archive_name, [error_row(archive_name, f"Ошибка обработки: {e}")], str(e)
+
+def _stream_ndjson(archives: List[tuple]) -> Iterator[str]:
+    """Одна строка JSON на серию, сразу после обработки ее архива."""
+    for _, rows, _ in _archive_rows(archives):
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+
+def _stream_sse(archives: List[tuple]) -> Iterator[str]:
+    """Server-sent events: "result" на серию, "error" при сбое архива, в конце - "done"."""
+    num_rows = 0
+    for archive_name, rows, error in _archive_rows(archives):
+        if error is not None:
+            yield f"event: error\ndata: {json.dumps({'archive_name': archive_name, 'error': error}, ensure_ascii=False)}\n\n"
+        for row in rows:
+            num_rows += 1
+            yield f"event: result\ndata: {json.dumps(row, ensure_ascii=False)}\n\n"
+    yield f"event: done\ndata: {json.dumps({'archives': len(archives), 'rows': num_rows})}\n\n"
+
+def _stream_format(request: Request, stream: Optional[str]) -> Optional[str]:
+    """Формат потокового ответа из параметра stream или заголовка Accept; None - обычный JSON."""
+    if stream is None:
+        accept = request.headers.get("accept", "")
+        stream = next((name for name, media_type in STREAM_MEDIA_TYPES.items() if media_type in accept), None)
+    if stream is not None and stream not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Неизвестный формат потока: {stream} (ndjson или sse).")
+    return stream
+
+def _removing_files(chunks: Iterator[str], paths: List[str]) -> Iterator[str]:
+    """Отдает поток и удаляет временные файлы, когда он закончен или прерван."""
+    try:
+        yield from chunks
+    finally:
+        for path in paths:
+            os.unlink(path)
+
+def _results_response(archives: List[tuple], stream: Optional[str], temp_paths: List[str] = ()):
+    """
+    Результаты обработки архивов: потоком (ndjson/sse) или одним JSON в конце.
+    temp_paths удаляются после того, как поток отдан.
+    """
+    if stream is not None:
+        generate = _stream_ndjson if stream == "ndjson" else _stream_sse
+        # Синхронный генератор Starlette итерирует в пуле потоков
+        return StreamingResponse(
+            _removing_files(generate(archives), list(temp_paths)), media_type=STREAM_MEDIA_TYPES[stream],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    all_results = []
+    for _, rows, _ in _archive_rows(archives):
+        all_results.extend(rows)
+    return {"results": all_results}
+
+def _save_upload(file: UploadFile) -> str:
+    """Сохраняет загруженный архив во временный файл: UploadFile закрывается после ответа."""
+    with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmp:
+        file.file.seek(0)
+        shutil.copyfileobj(file.file, tmp)
+        return tmp.name
 
 
 @app.post("/process", tags=["Processing"])
-async def process(files: List[UploadFile] = File(...)):
+def process(request: Request, files: List[UploadFile] = File(...),
+            stream: Optional[str] = Query(None, description="Потоковый ответ: ndjson или sse")):
     """
     Принимает один или несколько ZIP-архивов, обрабатывает их
     и возвращает результат в виде JSON.
+    С stream=ndjson / stream=sse (или Accept: application/x-ndjson / text/event-stream)
+    строки отдаются по мере обработки архивов, ошибки архивов - в том же потоке.
+    Обработчик синхронный: FastAPI выполняет его в пуле потоков, не блокируя event loop.
     """
-    all_results = []
+    stream = _stream_format(request, stream)
+    ready_model = model_state.require()
+    if stream is None:
+        # UploadFile уже лежит в SpooledTemporaryFile - парсим его напрямую, без read() в память
+        archives = [(file.filename, partial(process_archive, ready_model, file.file, file.filename)) for file in files]
+        return _results_response(archives, stream)
+
+    # Поток итерируется после выхода из обработчика, а FastAPI до 0.113 к этому времени
+    # уже закрывает UploadFile: архивы копируются во временные файлы, которые удаляет сам поток
+    temp_paths = []
+    try:
+        for file in files:
+            temp_paths.append(_save_upload(file))
+    except Exception:
+        for path in temp_paths:
+            os.unlink(path)
+        raise
+    archives = [(file.filename, partial(process_archive, ready_model, path, file.filename))
+                for file, path in zip(files, temp_paths)]
+    return _results_response(archives, stream, temp_paths)
+
+
+class PathsRequest(BaseModel):
+    paths: List[str]
+
 
+@app.post("/process/paths", tags=["Processing"])
+def process_paths(request: Request, body: PathsRequest,
+                  stream: Optional[str] = Query(None, description="Потоковый ответ: ndjson или sse")):
+    """
+    Обрабатывает исследования, которые уже лежат на сервере в каталоге MEDSCREEN_DATA_ROOT:
+    ZIP-архивы, папки DICOM и файлы .nii/.nii.gz (пути - относительно каталога).
+    Файлы читаются на месте, без загрузки и копирования. Ответ - как у /process.
+    """
+    stream = _stream_format(request, stream)
+    if not DATA_ROOT:
+        raise HTTPException(status_code=403, detail="Обработка по пути выключена: не задан MEDSCREEN_DATA_ROOT.")
+    try:
+        resolved = [(path, resolve_study_path(path)) for path in body.paths]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    ready_model = model_state.require()
+    archives = [(path, partial(process_study_path, ready_model, full_path, path)) for path, full_path in resolved]
+    return _results_response(archives, stream)
+
+
+@app.post("/jobs", tags=["Jobs"], status_code=202)
+async def create_job(files: List[UploadFile] = File(...)):
+    """
+    Ставит архивы в очередь на обработку и сразу возвращает id задания.
+    Если очередь заполнена или модель не загрузилась, возвращает 503.
+    """
+    if model_state.failed:
+        raise HTTPException(status_code=503, detail=f"Модель не загружена: {model_state.status['error']}")
+    archives = []
     for file in files:
-        file_content = await file.read()
-        series_data, error_message = parse_zip_archive(file_content)
-
-        if not series_data or error_message:
-            all_results.append({
-                'archive_name': file.filename, 'series_uid': error_message or "Parsing error",
-                'is_valid': False, 'has_pathology': False, 'pred_pathology': "0.0000",
-                'ml_processing_time': "0.00s", 'source_format': 'N/A', 'modality': 'N/A',
-                'body_part': 'N/A', 'orientation': 'N/A', 'num_frames': 0
-            })
-            continue
-
-        for series_uid, data in series_data.items():
-            meta = data['meta']
-            validation_checks = validate_series(meta)
-            is_valid = all(check['status'] for check in validation_checks)
-
-            if is_valid and len(data['frames']) > 0:
-                inference_results = model.run_inference(data['frames'])
-                has_pathology_flag = inference_results.get('study_has_pathology', False)
-                final_prob = inference_results.get('study_prob_pathology', 0.0)
-                ml_time = inference_results.get('study_processing_time', 0.0)
-            else:
-                has_pathology_flag, final_prob, ml_time = False, 0.0, 0.0
-
-            all_results.append({
-                'archive_name': file.filename,
-                'series_uid': series_uid,
-                'source_format': meta.get('SourceFormat', 'N/A'),
-                'modality': meta.get('Modality', 'N/A'),
-                'body_part': meta.get('BodyPartExamined', 'N/A'),
-                'orientation': meta.get('orientation', 'N/A'),
-                'num_frames': meta.get('num_frames', 0),
-                'is_valid': is_valid,
-                'has_pathology': has_pathology_flag,
-                'pred_pathology': f"{final_prob:.4f}",
-                'ml_processing_time': f"{ml_time:.2f}s"
-            })
+        archives.append((file.filename, await run_in_threadpool(_save_upload, file)))
 
-    return {"results": all_results}
+    try:
+        job = job_manager.submit(archives)
+    except queue.Full:
+        for _, path in archives:
+            os.unlink(path)
+        raise HTTPException(status_code=503, detail="Очередь заданий заполнена, повторите запрос позже.")
+
+    return {"job_id": job.job_id, "status": job.status, **job_manager.stats()}
+
+
+@app.get("/jobs", tags=["Jobs"])
+def jobs_stats():
+    """Глубина очереди и число заданий по статусам."""
+    return job_manager.stats()
+
+
+@app.get("/jobs/{job_id}", tags=["Jobs"])
+def get_job(job_id: str):
+    """Статус задания и уже готовые (частичные) результаты."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/results", tags=["Jobs"])
+def get_job_results(job_id: str):
+    """Итоговые результаты задания в формате `/process`. Пока задание не завершено - 409."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено.")
+    if job.status not in ("done", "failed"):
+        raise HTTPException(status_code=409, detail=f"Задание еще не завершено (статус: {job.status}).")
+    return {"status": job.status, "error": job.error, "results": job.results}
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+def metrics():
+    """Метрики в текстовом формате Prometheus: длительности этапов, размеры батчей, кэш, очередь."""
+    stats = job_manager.stats()
+    JOB_QUEUE_DEPTH.set(stats["queue_depth"])
+    for status in ("queued", "running", "done", "failed"):
+        JOBS.set(stats["jobs"].get(status, 0), status=status)
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 # Команда для локального запуска:
-# uvicorn api:app --host 0.0.0.0 --port 8000 --reload
\ No newline at end of file
+# uvicorn api:app --host 0.0.0.0 --port 8000 --reload
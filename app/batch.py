@@ -0,0 +1,232 @@
+# --- Пакетная обработка каталога исследований без UI и HTTP ---
+#
+# Запуск:
+#   python -m app.batch /data/studies --output results.csv
+#   python -m app.batch /data/studies --output results.parquet --workers 8   # каталог с частями Parquet
+#
+# Флоу:
+# 1. `discover_studies` обходит каталог: исследование - ZIP-архив, NIfTI-файл или папка
+#    с файлами исследования (DICOM/PNG/JPG), внутри которой нет архивов и NIfTI.
+# 2. Исследования, которые уже есть в выходном файле (колонка study_path), пропускаются:
+#    прерванный запуск продолжается с того же места. Исследование со сбоем обработки
+#    (модель, нехватка памяти, модельный сервер, чтение файла) в файл не пишется и будет
+#    обработано при следующем запуске; битые данные пишутся строкой ошибки.
+# 3. Пул потоков парсит исследования и считает их хэши (`parse_study_path`),
+#    не больше 2 x workers исследований одновременно в памяти.
+# 4. Единственный классификатор (`load_classifier`: локальная модель или модельный сервер)
+#    оценивает исследования по мере готовности (`series_rows`, через кэш результатов).
+# 5. Строки пишутся сразу: в CSV - по исследованию с flush, в Parquet - частями по --part-rows строк
+#    или раз в --flush-seconds (part-00000.parquet, ...; каждая часть записывается атомарно),
+#    так что при сбое теряются строки не больше чем одной части.
+#
+# Для Parquet нужен pyarrow (pip install pyarrow).
+
+import argparse
+import csv
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Set
+
+from app.file_io import MAX_ARCHIVE_SIZE_MB, compute_study_hash, is_study_file, parse_study_path
+from app.study_processing import error_row, is_error_row, series_rows
+
+logger = logging.getLogger("medscreen.batch")
+
+# Колонки отчета: путь исследования относительно каталога и строка `/process`
+COLUMNS = ["study_path"] + list(error_row("", "").keys())
+
+def _contains_study_files(path: str) -> bool:
+    return any(is_study_file(name) for _, _, filenames in os.walk(path) for name in filenames)
+
+def discover_studies(root: str) -> Iterator[str]:
+    """Пути исследований в каталоге (в стабильном порядке); символические ссылки не обходятся."""
+    for entry in sorted(os.scandir(root), key=lambda entry: entry.name):
+        if entry.name.startswith("."):
+            continue
+        if entry.is_file(follow_symlinks=False) and is_study_file(entry.name):
+            yield entry.path
+        elif entry.is_dir(follow_symlinks=False):
+            if _contains_study_files(entry.path):
+                # Каталог с архивами или NIfTI - обходим дальше
+                yield from discover_studies(entry.path)
+            elif any(filenames for _, _, filenames in os.walk(entry.path)):
+                yield entry.path
+
+class CsvOutput:
+    """CSV-отчет, который дописывается по исследованию."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._writer = None
+
+    def completed(self) -> Set[str]:
+        """Исследования, уже записанные в отчет; недописанная последняя строка отрезается."""
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return {row["study_path"] for row in csv.DictReader(f) if row.get("study_path")}
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        if self._file is None:
+            is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            self._file = open(self.path, "a", newline="", encoding="utf-8")
+            self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS, extrasaction="ignore")
+            if is_new:
+                self._writer.writeheader()
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+class ParquetOutput:
+    """
+    Каталог с частями Parquet: часть записывается атомарно, когда набралось part_rows строк
+    или с прошлой записи прошло flush_interval_s секунд.
+    """
+
+    def __init__(self, path: str, part_rows: int = 50, flush_interval_s: float = 30.0):
+        import pandas as pd
+        # Без движка Parquet лучше упасть до обработки, а не на первой части
+        pd.io.parquet.get_engine("auto")
+        self._pd = pd
+        self.path = path
+        self.part_rows = part_rows
+        self.flush_interval_s = flush_interval_s
+        self._buffer: List[Dict[str, Any]] = []
+        self._last_flush = time.monotonic()
+        os.makedirs(path, exist_ok=True)
+        self._next_part = len(self._parts())
+
+    def _parts(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.path) if name.startswith("part-") and name.endswith(".parquet"))
+
+    def completed(self) -> Set[str]:
+        done = set()
+        for name in self._parts():
+            done.update(self._pd.read_parquet(os.path.join(self.path, name), columns=["study_path"])["study_path"])
+        return done
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._buffer.extend(rows)
+        if len(self._buffer) >= self.part_rows or time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        part_path = os.path.join(self.path, f"part-{self._next_part:05d}.parquet")
+        self._pd.DataFrame(self._buffer, columns=COLUMNS).to_parquet(part_path + ".tmp", index=False)
+        os.replace(part_path + ".tmp", part_path)
+        self._next_part += 1
+        self._buffer = []
+
+    def close(self) -> None:
+        self._flush()
+
+def open_output(path: str, part_rows: int = 50, flush_interval_s: float = 30.0):
+    """CSV для *.csv, иначе каталог с частями Parquet."""
+    return CsvOutput(path) if path.lower().endswith(".csv") else ParquetOutput(path, part_rows, flush_interval_s)
+
+def _load_study(path: str, max_size_mb: int):
+    """Парсинг и хэш исследования (в пуле потоков)."""
+    data, error_message = parse_study_path(path, max_size_mb)
+    study_hash = compute_study_hash(path) if data and not error_message else None
+    return data, error_message, study_hash
+
+def run_batch(model, root: str, output, threshold: float = 0.1, workers: int = 4,
+              max_size_mb: int = MAX_ARCHIVE_SIZE_MB) -> Dict[str, int]:
+    """Обрабатывает все еще не записанные исследования каталога и возвращает счетчики."""
+    done = output.completed()
+    studies = [path for path in discover_studies(root) if os.path.relpath(path, root).replace(os.sep, "/") not in done]
+    stats = {"found": len(studies) + len(done), "skipped": len(done), "processed": 0, "failed": 0, "retry": 0}
+    logger.info(f"Исследований: {stats['found']}, уже в отчете: {stats['skipped']}, к обработке: {len(studies)}")
+
+    start_time = time.time()
+    pending_paths = iter(studies)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        in_flight = {}
+
+        def refill():
+            # Не больше 2 x workers разобранных исследований ждут модель
+            while len(in_flight) < 2 * max(1, workers):
+                path = next(pending_paths, None)
+                if path is None:
+                    return
+                in_flight[pool.submit(_load_study, path, max_size_mb)] = path
+
+        refill()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = in_flight.pop(future)
+                study_path = os.path.relpath(path, root).replace(os.sep, "/")
+                try:
+                    data, error_message, study_hash = future.result()
+                    if not data or error_message:
+                        rows = [error_row(study_path, error_message)]
+                    else:
+                        rows = series_rows(model, data, study_hash, study_path, threshold)
+                except Exception as e:
+                    # Сбой обработки, а не свойство исследования: строки не пишутся,
+                    # и следующий запуск обработает исследование заново
+                    logger.error(f"{study_path}: {e} (будет обработано при следующем запуске)")
+                    rows = None
+                    stats["retry"] += 1
+                if rows is not None:
+                    output.write([{"study_path": study_path, **row} for row in rows])
+                # Ошибка разбора, серия с битыми срезами или сбой обработки
+                if rows is None or any(is_error_row(row) for row in rows):
+                    stats["failed"] += 1
+                stats["processed"] += 1
+
+                if stats["processed"] % 10 == 0 or stats["processed"] == len(studies):
+                    rate = stats["processed"] / max(time.time() - start_time, 1e-9) * 60
+                    logger.info(f"Обработано {stats['processed']}/{len(studies)} ({rate:.1f} исследований/мин)")
+            refill()
+    return stats
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Пакетная обработка каталога исследований (ZIP, папки, NIfTI).")
+    parser.add_argument("input_dir", help="Каталог с исследованиями")
+    parser.add_argument("--output", required=True, help="Отчет: *.csv или каталог для частей Parquet")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Порог решения по исследованию")
+    parser.add_argument("--workers", type=int, default=4, help="Потоков для парсинга исследований")
+    parser.add_argument("--part-rows", type=int, default=50, help="Строк в одной части Parquet")
+    parser.add_argument("--flush-seconds", type=float, default=30.0,
+                        help="Записывать часть Parquet не реже, чем раз в столько секунд")
+    parser.add_argument("--max-archive-mb", type=int, default=MAX_ARCHIVE_SIZE_MB,
+                        help="Лимит размера ZIP-архива (МБ), 0 - без ограничения")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [BATCH] %(levelname)s: %(message)s")
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"Каталог не найден: {args.input_dir}")
+    try:
+        output = open_output(args.output, args.part_rows, args.flush_seconds)
+    except ImportError as e:
+        parser.error(f"Для Parquet нужен pyarrow: {e}")
+
+    # torch импортируется только здесь, если модельный сервер не задан
+    from app.model_client import load_classifier
+    model = load_classifier(warm_up=True)
+    try:
+        stats = run_batch(model, args.input_dir, output, args.threshold, args.workers, args.max_archive_mb)
+    finally:
+        output.close()
+    logger.info(f"Готово: обработано {stats['processed']}, с ошибками {stats['failed']} "
+                f"(из них повторить при следующем запуске: {stats['retry']}), пропущено {stats['skipped']}")
+    return 1 if stats["retry"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
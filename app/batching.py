@@ -0,0 +1,62 @@
+# --- Модуль динамического микро-батчинга для модели ---
+#
+# Флоу:
+# 1. Исследования, которые обрабатываются одновременно (потоки API, воркеры заданий),
+#    отправляют подготовленные срезы в общий `MicroBatchScheduler.submit`.
+# 2. Фоновый поток планировщика собирает срезы всех исследований в батчи
+#    размером до `max_batch_size`. Если в очереди не хватает срезов на полный батч,
+#    он ждет новые не дольше `max_wait_ms`.
+# 3. Батч целиком уходит в `predict_fn`, и предсказание каждого среза
+#    возвращается тому исследованию, от которого он пришел.
+#
+# Одиночный запрос почти не замедляется: все его срезы попадают в очередь сразу,
+# поэтому батчи заполняются без ожидания.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+class MicroBatchScheduler:
+    """Собирает элементы из одновременных запросов в полные батчи для одной модели."""
+
+    def __init__(self, predict_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 4, max_wait_ms: float = 10.0):
+        self._predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="medscreen-micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, items: List[Any]) -> List[Any]:
+        """Отправляет элементы в общую очередь и ждет их предсказания (в исходном порядке)."""
+        futures = []
+        for item in items:
+            future = Future()
+            self._queue.put((item, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _collect_batch(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Уже ожидающие элементы забираем без задержки
+                batch.append(self._queue.get(timeout=max(0.0, remaining)) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            try:
+                predictions = self._predict_fn([item for item, _ in batch])
+                for (_, future), prediction in zip(batch, predictions):
+                    future.set_result(prediction)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
@@ -5,6 +5,9 @@
 # 3. Возвращает список словарей, где каждый словарь - результат одной проверки.
 #    `[{"check": "Название", "status": True/False, "message": "Сообщение"}]`
 
+from app.metrics import stage_timer
+
+@stage_timer("validate")
 def validate_series(meta: dict) -> list:
     """Проводит валидацию серии по заданным критериям."""
     checks = []
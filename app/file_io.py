@@ -1,9 +1,15 @@
 # --- Модуль для парсинга входных ZIP-архивов ---
 #
-# Основная функция: parse_zip_archive(uploaded_file)
+# Основная функция: parse_zip_archive(file_input)
+# Для исследований на диске (пакетная обработка, API по пути): parse_study_path(path) - ZIP-архив,
+# папка исследования (DICOM/PNG/JPG/NIfTI внутри) или отдельный NIfTI-файл. Файлы читаются на месте,
+# без копий: архив открывается по пути, срезы папки декодируются по требованию, несжатый NIfTI
+# отображается в память (mmap). `resolve_study_path` пускает только пути внутри MEDSCREEN_DATA_ROOT.
 #
 # Флоу:
-# 1. Получает на вход загруженный ZIP-файл.
+# 1. Получает на вход ZIP-архив: путь к файлу, файлоподобный объект
+#    (в т.ч. SpooledTemporaryFile от FastAPI/UploadedFile от Streamlit) или bytes.
+#    Архив не копируется в память целиком: элементы читаются потоково.
 # 2. Анализирует содержимое, определяет тип данных (DICOM, NIfTI, PNG/JPG).
 # 3. Вызывает соответствующий внутренний обработчик.
 # 4. Возвращает стандартизированный результат в виде кортежа: (data, error_message).
@@ -11,7 +17,12 @@
 # Структура успешного вывода (data):
 # {
 #     "SeriesInstanceUID_1": {
-#         "frames": np.ndarray,  # 3D массив (срезы, высота, ширина)
+#         "frames": np.ndarray,  # 3D массив (срезы, высота, ширина) в компактном типе:
+#                                # int16 HU для КТ (uint16/int32/float32, если значения в int16
+#                                # не помещаются), uint8 для изображений; для серии однокадровых
+#                                # DICOM - LazyDicomVolume, декодирующий срезы по требованию
+#         "fingerprint": str,    # Дешевый отпечаток серии (UID, форма, выборочный хэш содержимого):
+#                                # ключ кэшей вместо хэширования всего объема
 #         "meta": {
 #             "SourceFormat": str,      # "DICOM Series", "NIfTI", "Image Series"
 #             "Modality": str,          # "CT", "NIFTI", "IMAGE"
@@ -28,13 +39,36 @@
 #
 # При ошибке `data` будет `None`, а `error_message` - строкой с описанием.
 
+import hashlib
 import io
+import os
+import shutil
+import tempfile
 import zipfile
 import numpy as np
 import pydicom
 import nibabel
 from PIL import Image
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from app.metrics import stage_timer
+
+# Лимит размера архива (МБ). Это настраиваемое ограничение, а не защита памяти:
+# архив читается потоково. 0 - без ограничения.
+MAX_ARCHIVE_SIZE_MB = int(os.getenv("MEDSCREEN_MAX_ARCHIVE_MB", "500"))
+
+# Число потоков для чтения и декодирования DICOM-срезов. 1 - последовательно.
+DICOM_DECODE_WORKERS = int(os.getenv("MEDSCREEN_DECODE_WORKERS", "1"))
+
+# Размер блока при потоковом копировании элементов архива
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+# Каталог с исследованиями на сервере, доступный для обработки по пути; пусто - обработка по пути выключена
+DATA_ROOT = os.getenv("MEDSCREEN_DATA_ROOT", "")
+
+# Сколько срезов (равномерно по объему) входит в выборочный хэш отпечатка серии
+_FINGERPRINT_SAMPLE_SLICES = 16
 
 def _get_dicom_orientation(ds):
     """Определяет ориентацию срезов DICOM (Axial, Sagittal, Coronal)."""
@@ -46,18 +80,208 @@ def _get_dicom_orientation(ds):
     except Exception:
         return "Unknown"
 
-def _parse_dicom_series(zf, dcm_files):
+def _map_in_pool(func, items, workers: int) -> list:
+    """Применяет func к items в пуле потоков с сохранением порядка. workers <= 1 - последовательно."""
+    if workers <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+# Целые типы хранения по возрастанию размера: берется первый, в который помещается весь диапазон
+_COMPACT_INT_DTYPES = (np.dtype(np.int16), np.dtype(np.uint16), np.dtype(np.int32))
+
+def _rescale_dtype(slope: float, intercept: float, raw_min: int, raw_max: int) -> np.dtype:
+    """
+    Компактный тип хранения для raw * slope + intercept, raw в [raw_min, raw_max]:
+    наименьший целый тип, в который гарантированно помещается результат (int16 для HU),
+    иначе (нецелый rescale или слишком широкий диапазон) - float32.
+    """
+    if not (float(slope).is_integer() and float(intercept).is_integer()):
+        return np.dtype(np.float32)
+    ends = (raw_min * int(slope) + int(intercept), raw_max * int(slope) + int(intercept))
+    for dtype in _COMPACT_INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= min(ends) and max(ends) <= info.max:
+            return dtype
+    return np.dtype(np.float32)
+
+def _dicom_raw_range(ds) -> tuple:
+    """Диапазон хранимых значений пикселей DICOM по заголовку (BitsStored, PixelRepresentation)."""
+    bits = int(getattr(ds, "BitsStored", None) or getattr(ds, "BitsAllocated", 16))
+    if int(getattr(ds, "PixelRepresentation", 0)) == 1:
+        return -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+    return 0, (1 << bits) - 1
+
+def _rescale_into(out: np.ndarray, pixels: np.ndarray, slope: float, intercept: float) -> None:
+    """Записывает pixels * slope + intercept в готовый 2D-буфер out за один проход."""
+    if np.issubdtype(out.dtype, np.integer):
+        # Считаем в int64 только для одного среза, чтобы не словить переполнение;
+        # clip срабатывает, только если значения не соответствуют заголовку
+        values = pixels.astype(np.int64) * int(slope) + int(intercept)
+        info = np.iinfo(out.dtype)
+        np.clip(values, info.min, info.max, out=values)
+        out[...] = values
+    else:
+        np.multiply(pixels, slope, out=out, casting='unsafe')
+        out += intercept
+
+class DicomDecodeError(ValueError):
+    """Пиксели среза DICOM не декодируются: битые данные или неподдерживаемое сжатие."""
+
+def _read_dicom_header(zf, filename):
+    """Читает заголовок DICOM-файла без пиксельных данных. Возвращает ds или None."""
+    try:
+        with zf.open(filename) as f:
+            ds = pydicom.dcmread(f, stop_before_pixels=True, force=True)
+    except Exception:
+        return None
+    # PixelData при stop_before_pixels не читается - ориентируемся на размеры изображения
+    if 'Rows' not in ds or 'Columns' not in ds:
+        return None
+    return ds
+
+class LazyDicomVolume:
+    """
+    3D-объем DICOM-серии, который декодирует срезы только при обращении к ним.
+    Поддерживает len(), .shape, индексацию числом, срезом или списком индексов
+    и np.asarray() для полной материализации.
+    Срезы хранятся в компактном типе (int16 HU, если rescale целочисленный и диапазон raw_range в него помещается).
+    """
+    ndim = 3
+
+    def __init__(self, zf, filenames: list, rows: int, columns: int,
+                 slope: float = 1.0, intercept: float = 0.0, raw_range: tuple = (-32768, 32767),
+                 decode_workers: int = DICOM_DECODE_WORKERS):
+        self._zf = zf
+        self._filenames = list(filenames)
+        self.shape = (len(self._filenames), int(rows), int(columns))
+        self._slope = slope
+        self._intercept = intercept
+        self.dtype = _rescale_dtype(slope, intercept, *raw_range)
+        self.decode_workers = decode_workers
+        # Счетчик декодированных срезов (для диагностики)
+        self.num_decoded = 0
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def cache_key(self) -> str:
+        """Дешевый ключ содержимого: имена и CRC элементов архива, без декодирования."""
+        infos = [self._zf.getinfo(name) for name in self._filenames]
+        signature = repr((self.shape, [(i.filename, i.CRC, i.file_size) for i in infos]))
+        return hashlib.sha1(signature.encode()).hexdigest()
+
+    def _decode_into(self, out: np.ndarray, index: int) -> None:
+        try:
+            with self._zf.open(self._filenames[index]) as f:
+                pixels = pydicom.dcmread(f, force=True).pixel_array
+        except Exception as e:
+            raise DicomDecodeError(f"Не удалось декодировать срез {self._filenames[index]}: {e}") from e
+        _rescale_into(out, pixels, self._slope, self._intercept)
+
+    @stage_timer("decode")
+    def _decode(self, index: int) -> np.ndarray:
+        out = np.empty(self.shape[1:], dtype=self.dtype)
+        self._decode_into(out, index)
+        return out
+
+    @stage_timer("decode")
+    def take(self, indices) -> np.ndarray:
+        """Декодирует выбранные срезы (в пуле потоков) прямо в заранее выделенный 3D-буфер."""
+        indices = [int(i) for i in indices]
+        volume = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        _map_in_pool(lambda pos: self._decode_into(volume[pos], indices[pos]), range(len(indices)), self.decode_workers)
+        self.num_decoded += len(indices)
+        return volume
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            # Индексация по нескольким осям: сначала выбираем срезы, остальное делает numpy
+            frames, rest = self[key[0]], key[1:]
+            return frames[rest] if isinstance(key[0], (int, np.integer)) else frames[(slice(None),) + rest]
+        if isinstance(key, (int, np.integer)):
+            index = range(len(self))[key]
+            self.num_decoded += 1
+            return self._decode(index)
+        if isinstance(key, slice):
+            return self.take(range(len(self))[key])
+        key = np.asarray(key)
+        if key.dtype == bool:
+            key = np.flatnonzero(key)
+        return self.take(key.ravel())
+
+    def __array__(self, dtype=None, copy=None):
+        volume = self.take(range(len(self)))
+        return volume if dtype is None else volume.astype(dtype)
+
+class _DirectoryArchive:
+    """
+    Папка исследования с тем интерфейсом ZipFile, который нужен парсерам (namelist/open/getinfo).
+    Файлы, которые по символическим ссылкам ведут за пределы папки, в нее не входят.
+    """
+
+    def __init__(self, root: str):
+        self.filename = root
+        self._real_root = os.path.realpath(root)
+
+    def _inside(self, path: str) -> bool:
+        return os.path.commonpath([self._real_root, os.path.realpath(path)]) == self._real_root
+
+    def namelist(self) -> list:
+        names = []
+        # Ссылки на каталоги os.walk не обходит, ссылки на файлы вне папки пропускаются
+        for dirpath, dirnames, filenames in os.walk(self.filename):
+            dirnames.sort()
+            rel_dir = os.path.relpath(dirpath, self.filename)
+            for name in sorted(filenames):
+                if self._inside(os.path.join(dirpath, name)):
+                    names.append(name if rel_dir == "." else f"{rel_dir.replace(os.sep, '/')}/{name}")
+        return names
+
+    def path_of(self, name: str) -> str:
+        path = os.path.join(self.filename, *name.split("/"))
+        if not self._inside(path):
+            # Как ZipFile для отсутствующего элемента
+            raise KeyError(f"Файл вне папки исследования: {name}")
+        return path
+
+    def open(self, name: str):
+        return open(self.path_of(name), "rb")
+
+    def getinfo(self, name: str) -> zipfile.ZipInfo:
+        stat = os.stat(self.path_of(name))
+        info = zipfile.ZipInfo(name)
+        # Вместо CRC (его у файла на диске нет) - время изменения: ключ меняется вместе с файлом
+        info.CRC, info.file_size = stat.st_mtime_ns, stat.st_size
+        return info
+
+    def close(self) -> None:
+        pass
+
+def _parse_dicom_series(zf, dcm_files, decode_workers: int = DICOM_DECODE_WORKERS):
     """Парсит серию DICOM-файлов из архива."""
     if not dcm_files:
         return None, "В архиве не найдено DICOM-файлов."
 
     # Обработка многокадрового DICOM (если он один в архиве)
     if len(dcm_files) == 1:
-        with zf.open(dcm_files[0]) as f:
-            ds = pydicom.dcmread(io.BytesIO(f.read()), force=True)
-        if int(getattr(ds, "NumberOfFrames", 1)) > 1:
-            volume = ds.pixel_array.astype(np.float32)
-            volume = volume * float(getattr(ds, "RescaleSlope", 1.0)) + float(getattr(ds, "RescaleIntercept", 0.0))
+        ds = _read_dicom_header(zf, dcm_files[0])
+        if ds is not None and int(getattr(ds, "NumberOfFrames", 1)) > 1:
+            with zf.open(dcm_files[0]) as f:
+                ds = pydicom.dcmread(f, force=True)
+            slope = float(getattr(ds, "RescaleSlope", 1.0))
+            intercept = float(getattr(ds, "RescaleIntercept", 0.0))
+            pixels = ds.pixel_array
+            # Кадры уже декодированы: тип хранения - по фактическому диапазону значений
+            if np.issubdtype(pixels.dtype, np.integer):
+                dtype = _rescale_dtype(slope, intercept, int(pixels.min()), int(pixels.max()))
+            else:
+                dtype = np.dtype(np.float32)
+            volume = np.empty(pixels.shape, dtype=dtype)
+            for frame_idx in range(len(pixels)):
+                _rescale_into(volume[frame_idx], pixels[frame_idx], slope, intercept)
+            del pixels
             series_uid = getattr(ds, "SeriesInstanceUID", "MultiFrame_DICOM")
             meta = {
                 "SourceFormat": "Multi-frame DICOM",
@@ -71,33 +295,38 @@ def _parse_dicom_series(zf, dcm_files):
             }
             return {series_uid: {"frames": volume, "meta": meta}}, None
 
-    # Обработка серии однокадровых DICOM
+    # Обработка серии однокадровых DICOM: первый проход читает только заголовки
+    # (в пуле потоков, порядок файлов сохраняется) и строит отсортированный индекс серий.
+    # Пиксели декодируются позже и только для тех срезов, к которым обратятся.
+    headers = _map_in_pool(lambda filename: _read_dicom_header(zf, filename), dcm_files, decode_workers)
+
     series_dict = defaultdict(list)
-    for filename in dcm_files:
-        with zf.open(filename) as f:
-            try:
-                ds = pydicom.dcmread(f, force=True)
-                if 'PixelData' in ds:
-                    # Если UID отсутствует, используем "default_series" как ключ
-                    uid = getattr(ds, 'SeriesInstanceUID', 'default_series')
-                    series_dict[uid].append(ds)
-            except Exception:
-                continue
+    for filename, ds in zip(dcm_files, headers):
+        if ds is None:
+            continue
+        # Если UID отсутствует, используем "default_series" как ключ
+        uid = getattr(ds, 'SeriesInstanceUID', 'default_series')
+        series_dict[uid].append((filename, ds))
     
     if not series_dict:
         return None, "Не удалось прочитать DICOM-серии в архиве."
 
     processed_series = {}
-    for series_uid, datasets in series_dict.items():
-        datasets.sort(key=lambda ds: int(getattr(ds, 'InstanceNumber', 0)))
-        proxy_ds = datasets[0]
-        volume = np.stack([ds.pixel_array for ds in datasets]).astype(np.float32)
-        volume = volume * float(getattr(proxy_ds, "RescaleSlope", 1.0)) + float(getattr(proxy_ds, "RescaleIntercept", 0.0))
+    for series_uid, entries in series_dict.items():
+        entries.sort(key=lambda entry: int(getattr(entry[1], 'InstanceNumber', 0)))
+        proxy_ds = entries[0][1]
+        volume = LazyDicomVolume(
+            zf, [filename for filename, _ in entries], proxy_ds.Rows, proxy_ds.Columns,
+            slope=float(getattr(proxy_ds, "RescaleSlope", 1.0)),
+            intercept=float(getattr(proxy_ds, "RescaleIntercept", 0.0)),
+            raw_range=_dicom_raw_range(proxy_ds),
+            decode_workers=decode_workers,
+        )
         meta = {
             "SourceFormat": "DICOM Series",
             "Modality": getattr(proxy_ds, "Modality", "N/A"),
             "orientation": _get_dicom_orientation(proxy_ds),
-            "num_frames": len(datasets),
+            "num_frames": len(entries),
             "StudyInstanceUID": getattr(proxy_ds, "StudyInstanceUID", "N/A"),
             "PixelSpacing": str(getattr(proxy_ds, "PixelSpacing", "N/A")),
             "SliceThickness": str(getattr(proxy_ds, "SliceThickness", "N/A")),
@@ -107,18 +336,66 @@ def _parse_dicom_series(zf, dcm_files):
         
     return processed_series, None
 
+def _load_nifti_volume(nii_img) -> np.ndarray:
+    """Читает данные NIfTI в компактном типе, без промежуточного float64 из get_fdata()."""
+    proxy = nii_img.dataobj
+    if not nibabel.is_proxy(proxy):
+        # Образ, созданный в памяти: данные уже лежат массивом
+        volume = np.asarray(proxy)
+        return volume.astype(np.float32) if volume.dtype == np.float64 else volume
+
+    raw_dtype = nii_img.get_data_dtype()
+    slope, intercept = float(proxy.slope), float(proxy.inter)
+    dtype = np.dtype(np.float32)
+    if np.issubdtype(raw_dtype, np.integer):
+        dtype = _rescale_dtype(slope, intercept, int(np.iinfo(raw_dtype).min), int(np.iinfo(raw_dtype).max))
+    if dtype == np.float32:
+        # nibabel масштабирует сразу в float32
+        return np.asarray(proxy, dtype=np.float32)
+
+    raw = np.asarray(proxy.get_unscaled())
+    if slope == 1 and intercept == 0:
+        # Целые значения без масштабирования хранятся как есть (и остаются отображением файла)
+        return raw
+    volume = np.empty(raw.shape, dtype=dtype)
+    for z in range(raw.shape[-1]):
+        _rescale_into(volume[..., z], raw[..., z], slope, intercept)
+    return volume
+
 def _parse_nifti(zf, nii_files):
     """Парсит NIfTI-файл из архива."""
     if len(nii_files) > 1:
         return None, "Архив должен содержать только один NIfTI-файл."
     
     nii_filename = nii_files[0]
+    if isinstance(zf, _DirectoryArchive):
+        # Файл уже лежит на диске: копия не нужна, несжатый файл отображается в память
+        return _read_nifti(zf.path_of(nii_filename), nii_filename, mmap=True)
+
+    suffix = ".nii.gz" if nii_filename.lower().endswith(".gz") else ".nii"
+    tmp_path = None
     try:
-        with zf.open(nii_filename) as f:
-            # Nibabel работает с файлоподобными объектами
-            nii_img = nibabel.Nifti1Image.from_stream(io.BytesIO(f.read()))
-        
-        volume = nii_img.get_fdata().astype(np.float32)
+        # Потоково выгружаем элемент во временный файл: nibabel сам разберется
+        # со сжатием по расширению и не потребуется копия в памяти
+        with zf.open(nii_filename) as f, tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+            shutil.copyfileobj(f, tmp, _COPY_CHUNK_SIZE)
+            tmp_path = tmp.name
+        return _read_nifti(tmp_path, nii_filename)
+    except Exception as e:
+        return None, f"Ошибка чтения NIfTI файла: {e}"
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+
+def _read_nifti(path: str, nii_filename: str, mmap: bool = False):
+    """
+    Читает NIfTI-файл с диска; nii_filename - имя для UID серии.
+    С mmap=True несжатые данные без масштабирования не копируются: объем - отображение файла
+    (временные файлы так читать нельзя - они удаляются сразу после чтения).
+    """
+    try:
+        nii_img = nibabel.load(path, mmap="r" if mmap else False)
+        volume = _load_nifti_volume(nii_img)
         zooms = nii_img.header.get_zooms()
         
         orientation_code = ''.join(nibabel.aff2axcodes(nii_img.affine))
@@ -147,25 +424,30 @@ def _parse_nifti(zf, nii_files):
     except Exception as e:
         return None, f"Ошибка чтения NIfTI файла: {e}"
 
-def _parse_image_series(zf, img_files):
-    """Парсит серию изображений (PNG/JPG) из архива."""
+def _parse_image_series(zf, img_files, archive_name=None):
+    """Парсит серию изображений (PNG/JPG) из архива; archive_name - исходное имя архива для UID серии."""
     img_files.sort() # Сортировка по имени файла для правильного порядка срезов
-    frames = []
-    for filename in img_files:
-        with zf.open(filename) as f:
-            img = Image.open(io.BytesIO(f.read())).convert('L') # 'L' = grayscale
-            frames.append(np.array(img))
-    
-    if not frames:
+    if not img_files:
         return None, "Не найдено изображений в архиве."
 
-    volume = np.stack(frames).astype(np.float32)
-    series_uid = "ImageSeries_" + zf.filename.split('/')[-1]
+    volume = None
+    for frame_idx, filename in enumerate(img_files):
+        with zf.open(filename) as f:
+            img = Image.open(f).convert('L') # 'L' = grayscale
+            if volume is None:
+                # Один буфер uint8 на всю серию вместо списка кадров и np.stack
+                volume = np.empty((len(img_files), img.height, img.width), dtype=np.uint8)
+            volume[frame_idx] = np.asarray(img)
+
+    # Временная копия загрузки называется случайно, у архивов из памяти имени может не быть,
+    # а у SpooledTemporaryFile, выгруженного на диск, имя - номер файлового дескриптора
+    archive_path = archive_name or (zf.filename if isinstance(zf.filename, str) else "archive")
+    series_uid = "ImageSeries_" + os.path.basename(archive_path)
     meta = {
         "SourceFormat": "Image Series",
         "Modality": "IMAGE",
         "orientation": "Unknown",
-        "num_frames": len(frames),
+        "num_frames": len(img_files),
         "StudyInstanceUID": "N/A",
         "PixelSpacing": "N/A",
         "SliceThickness": "N/A",
@@ -173,44 +455,164 @@ def _parse_image_series(zf, img_files):
     }
     return {series_uid: {"frames": volume, "meta": meta}}, None
 
-def parse_zip_archive(file_input):
-    """Определяет тип данных в ZIP и вызывает соответствующий парсер."""
+def study_fingerprint(series_uid: str, frames) -> str:
+    """Отпечаток серии по UID, форме и выборке содержимого; ленивый объем - по CRC элементов архива."""
+    digest = hashlib.sha1(repr((series_uid, tuple(frames.shape), str(frames.dtype))).encode())
+    if isinstance(frames, LazyDicomVolume):
+        digest.update(frames.cache_key.encode())
+    elif len(frames):
+        sample = np.unique(np.linspace(0, len(frames) - 1, _FINGERPRINT_SAMPLE_SLICES).round().astype(int))
+        for index in sample:
+            digest.update(np.ascontiguousarray(frames[index]).data)
+    return digest.hexdigest()
+
+def _get_input_size(file_input) -> int:
+    """Определяет размер входа, не читая его в память."""
+    if isinstance(file_input, (bytes, bytearray, memoryview)):
+        return len(file_input)
+    if isinstance(file_input, (str, os.PathLike)):
+        return os.path.getsize(file_input)
+    position = file_input.tell()
+    size = file_input.seek(0, os.SEEK_END)
+    file_input.seek(position)
+    return size
+
+def compute_archive_hash(file_input) -> str:
+    """Потоково считает SHA-256 содержимого архива (путь, файлоподобный объект или bytes)."""
+    digest = hashlib.sha256()
+    if isinstance(file_input, (bytes, bytearray, memoryview)):
+        digest.update(file_input)
+        return digest.hexdigest()
+    if isinstance(file_input, (str, os.PathLike)):
+        with open(file_input, 'rb') as f:
+            for chunk in iter(lambda: f.read(_COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    position = file_input.tell()
+    file_input.seek(0)
+    for chunk in iter(lambda: file_input.read(_COPY_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    file_input.seek(position)
+    return digest.hexdigest()
+
+def _open_zip(file_input) -> zipfile.ZipFile:
+    """Открывает ZIP из пути, файлоподобного объекта или bytes без копирования."""
+    if isinstance(file_input, (bytes, bytearray, memoryview)):
+        # BytesIO разделяет буфер с исходными bytes, копии не создается
+        return zipfile.ZipFile(io.BytesIO(file_input))
+    if hasattr(file_input, 'seek'):
+        file_input.seek(0)
+    return zipfile.ZipFile(file_input)
+
+def _parse_archive(zf: zipfile.ZipFile, decode_workers: int, archive_name=None):
+    """Определяет тип данных в открытом ZIP и вызывает соответствующий парсер."""
+    file_list = [f for f in zf.namelist() if not f.startswith('__MACOSX/') and not f.endswith('/')]
+
+    if not file_list:
+        return None, "Архив пуст."
+
+    # Сначала проверяем на явные форматы, чтобы избежать ложных срабатываний
+    nii_files = [f for f in file_list if f.lower().endswith(('.nii', '.nii.gz'))]
+    if nii_files:
+        return _parse_nifti(zf, nii_files)
+
+    img_files = [f for f in file_list if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    if img_files:
+        return _parse_image_series(zf, img_files, archive_name)
+
+    # Если нет явных форматов, пробуем прочитать как DICOM
     try:
-        if hasattr(file_input, 'read'):
-            file_content = file_input.read()
-        else:
-            file_content = file_input
+        with zf.open(file_list[0]) as f:
+            pydicom.dcmread(f, stop_before_pixels=True, force=True)
+        # Если чтение успешно, считаем все файлы в архиве DICOM-серией
+        return _parse_dicom_series(zf, file_list, decode_workers)
+    except pydicom.errors.InvalidDicomError:
+        # Если первый файл не DICOM, выдаем ошибку
+        return None, "В архиве не найдены поддерживаемые файлы (.nii, .png, .jpg) и он не является DICOM-серией."
+
+def _add_fingerprints(data) -> None:
+    for series_uid, series in (data or {}).items():
+        series["fingerprint"] = study_fingerprint(series_uid, series["frames"])
+
+@stage_timer("parse")
+def parse_zip_archive(file_input, max_size_mb: int = MAX_ARCHIVE_SIZE_MB, decode_workers: int = DICOM_DECODE_WORKERS,
+                      archive_name=None):
+    """
+    Определяет тип данных в ZIP и вызывает соответствующий парсер.
+    archive_name - исходное имя архива (например, загруженного и сохраненного во временный файл):
+    из него строится UID серии изображений, а значит, и ключ кэша результатов.
+    """
+    return _parse_zip(file_input, max_size_mb, decode_workers, archive_name)
 
-        # Добавляем проверку размера
-        if len(file_content) > 500 * 1024 * 1024:  # 500MB лимит
-            return None, "Файл слишком большой (>500MB)"
+def _parse_zip(file_input, max_size_mb: int, decode_workers: int, archive_name=None):
+    """parse_zip_archive без замера этапа: parse_study_path замеряет его сам."""
+    try:
+        if max_size_mb and _get_input_size(file_input) > max_size_mb * 1024 * 1024:
+            return None, f"Файл слишком большой (>{max_size_mb}MB)"
         
-        with zipfile.ZipFile(io.BytesIO(file_content)) as zf:
-            file_list = [f for f in zf.namelist() if not f.startswith('__MACOSX/') and not f.endswith('/')]
-
-            if not file_list:
-                return None, "Архив пуст."
-
-            # Сначала проверяем на явные форматы, чтобы избежать ложных срабатываний
-            nii_files = [f for f in file_list if f.lower().endswith(('.nii', '.nii.gz'))]
-            if nii_files:
-                return _parse_nifti(zf, nii_files)
-
-            img_files = [f for f in file_list if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            if img_files:
-                return _parse_image_series(zf, img_files)
-
-            # Если нет явных форматов, пробуем прочитать как DICOM
-            try:
-                with zf.open(file_list[0]) as f:
-                    pydicom.dcmread(f, stop_before_pixels=True, force=True)
-                # Если чтение успешно, считаем все файлы в архиве DICOM-серией
-                return _parse_dicom_series(zf, file_list)
-            except pydicom.errors.InvalidDicomError:
-                # Если первый файл не DICOM, выдаем ошибку
-                return None, "В архиве не найдены поддерживаемые файлы (.nii, .png, .jpg) и он не является DICOM-серией."
+        zf = _open_zip(file_input)
+        data = None
+        try:
+            data, error_message = _parse_archive(zf, decode_workers, archive_name)
+            _add_fingerprints(data)
+            return data, error_message
+        finally:
+            # Ленивые DICOM-объемы читают срезы из архива по требованию,
+            # поэтому архив остается открытым, пока они живы
+            if not any(isinstance(series["frames"], LazyDicomVolume) for series in (data or {}).values()):
+                zf.close()
 
     except zipfile.BadZipFile:
         return None, "Загруженный файл не является ZIP-архивом или поврежден."
     except Exception as e:
-        return None, f"Произошла непредвиденная ошибка: {e}"
\ No newline at end of file
+        return None, f"Произошла непредвиденная ошибка: {e}"
+
+def resolve_study_path(path: str, root: str = DATA_ROOT) -> str:
+    """
+    Абсолютный путь исследования внутри root (ZIP, NIfTI или папка).
+    ValueError, если обработка по пути выключена, путь выходит за root (в т.ч. по симлинку) или не подходит.
+    """
+    if not root:
+        raise ValueError("Обработка по пути выключена: не задан MEDSCREEN_DATA_ROOT.")
+    real_root = os.path.realpath(root)
+    real_path = os.path.realpath(os.path.join(real_root, path))
+    if os.path.commonpath([real_root, real_path]) != real_root:
+        raise ValueError(f"Путь вне каталога данных: {path}")
+    if not os.path.exists(real_path):
+        raise ValueError(f"Путь не найден: {path}")
+    if not os.path.isdir(real_path) and not is_study_file(real_path):
+        raise ValueError(f"Ожидается ZIP-архив, файл .nii/.nii.gz или папка исследования: {path}")
+    return real_path
+
+def is_study_file(path: str) -> bool:
+    """Файл, который сам по себе является исследованием: ZIP-архив или NIfTI."""
+    return path.lower().endswith((".zip", ".nii", ".nii.gz"))
+
+@stage_timer("parse")
+def parse_study_path(path: str, max_size_mb: int = MAX_ARCHIVE_SIZE_MB, decode_workers: int = DICOM_DECODE_WORKERS):
+    """Парсит исследование на диске: ZIP-архив, папку исследования или NIfTI-файл. Формат вывода - как у parse_zip_archive."""
+    if not os.path.isdir(path) and not path.lower().endswith((".nii", ".nii.gz")):
+        return _parse_zip(path, max_size_mb, decode_workers)
+    try:
+        if os.path.isdir(path):
+            # Ленивые DICOM-объемы читают файлы папки по требованию: закрывать нечего
+            data, error_message = _parse_archive(_DirectoryArchive(path), decode_workers)
+        else:
+            data, error_message = _read_nifti(path, os.path.basename(path), mmap=True)
+        _add_fingerprints(data)
+        return data, error_message
+    except Exception as e:
+        return None, f"Произошла непредвиденная ошибка: {e}"
+
+def compute_study_hash(path: str) -> str:
+    """SHA-256 исследования на диске: архива или файла целиком, для папки - имен и содержимого всех файлов."""
+    if not os.path.isdir(path):
+        return compute_archive_hash(path)
+    digest = hashlib.sha256()
+    archive = _DirectoryArchive(path)
+    for name in archive.namelist():
+        digest.update(name.encode() + b"\0")
+        with archive.open(name) as f:
+            for chunk in iter(lambda: f.read(_COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,140 @@
+# --- Модуль фоновой обработки заданий API ---
+#
+# Флоу:
+# 1. `JobManager.submit` получает список архивов (имя, путь к временному файлу),
+#    создает задание и кладет его в ограниченную очередь. Если очередь полна -
+#    бросает `queue.Full`, и API отвечает 503.
+# 2. Фоновые потоки-воркеры берут задания из очереди и обрабатывают архивы
+#    по одному (`process_archive`), пополняя `results` по мере готовности.
+# 3. `get` отдает задание по id (статус и частичные результаты), `stats` -
+#    глубину очереди и число заданий по статусам.
+#
+# Статусы задания: "queued" -> "running" -> "done" / "failed".
+
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.study_processing import process_archive, error_row
+
+# Максимальное число заданий, ожидающих в очереди
+JOB_QUEUE_SIZE = int(os.getenv("MEDSCREEN_JOB_QUEUE_SIZE", "16"))
+# Число фоновых воркеров
+JOB_WORKERS = int(os.getenv("MEDSCREEN_JOB_WORKERS", "1"))
+# Сколько завершенных заданий хранить в памяти
+JOB_RETENTION = int(os.getenv("MEDSCREEN_JOB_RETENTION", "1000"))
+
+@dataclass
+class Job:
+    """Задание на обработку одного или нескольких архивов."""
+    job_id: str
+    archives: List[Tuple[str, str]]  # (имя архива, путь к временному файлу)
+    status: str = "queued"
+    results: List[Dict[str, Any]] = field(default_factory=list)
+    processed_archives: int = 0
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self, include_results: bool = True) -> Dict[str, Any]:
+        data = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "total_archives": len(self.archives),
+            "processed_archives": self.processed_archives,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_results:
+            data["results"] = list(self.results)
+        return data
+
+class JobManager:
+    """Ограниченная очередь заданий и пул фоновых воркеров."""
+
+    def __init__(self, model_provider: Callable[[], Any], queue_size: int = JOB_QUEUE_SIZE,
+                 num_workers: int = JOB_WORKERS, retention: int = JOB_RETENTION):
+        self._model_provider = model_provider
+        self._queue: "queue.Queue[Job]" = queue.Queue(maxsize=queue_size)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._num_workers = num_workers
+        self._retention = retention
+        self._workers: List[threading.Thread] = []
+
+    def start(self) -> None:
+        """Запускает фоновые воркеры (повторный вызов ничего не делает)."""
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self._num_workers):
+                worker = threading.Thread(target=self._worker_loop, name=f"medscreen-job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, archives: List[Tuple[str, str]]) -> Job:
+        """Ставит задание в очередь. Бросает queue.Full, если очередь заполнена."""
+        job = Job(job_id=uuid.uuid4().hex, archives=archives)
+        with self._lock:
+            self._queue.put_nowait(job)
+            self._jobs[job.job_id] = job
+            self._trim_finished()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди и число заданий по статусам."""
+        with self._lock:
+            by_status: Dict[str, int] = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self._queue.maxsize,
+            "workers": self._num_workers,
+            "jobs": by_status,
+        }
+
+    def _trim_finished(self) -> None:
+        # Выбрасываем самые старые завершенные задания сверх лимита
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ("done", "failed")]
+        for job_id in finished[:max(0, len(finished) - self._retention)]:
+            del self._jobs[job_id]
+
+    def _worker_loop(self) -> None:
+        while True:
+            job = self._queue.get()
+            try:
+                self._run_job(job)
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job: Job) -> None:
+        job.status, job.started_at = "running", time.time()
+        try:
+            model = self._model_provider()
+            for archive_name, path in job.archives:
+                try:
+                    job.results.extend(process_archive(model, path, archive_name))
+                except Exception as e:
+                    job.results.append(error_row(archive_name, f"Ошибка обработки: {e}"))
+                job.processed_archives += 1
+            job.status = "done"
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+        finally:
+            job.finished_at = time.time()
+            for _, path in job.archives:
+                if os.path.exists(path):
+                    os.unlink(path)
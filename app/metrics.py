@@ -0,0 +1,153 @@
+# --- Модуль метрик (Prometheus text format) ---
+#
+# Флоу:
+# 1. Модули пайплайна пишут метрики в общий реестр:
+#    - `stage_timer("parse")` замеряет длительность этапа в гистограмму STAGE_SECONDS;
+#    - гистограммы размеров (срезов на исследование, размер батча) и счетчики (кэш).
+# 2. `render_prometheus` отдает все метрики реестра в текстовом формате Prometheus,
+#    эндпоинт `/metrics` в `api.py` возвращает его как есть.
+#
+# Без внешних зависимостей: метрики - простые потокобезопасные счетчики в памяти процесса.
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Границы корзин по умолчанию для длительностей (секунды)
+DEFAULT_TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_REGISTRY: List["_Metric"] = []
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self._samples())
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(_Metric):
+    """Текущее значение (может расти и падать)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин (накопительные счетчики, как в Prometheus)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_TIME_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # ключ меток -> [счетчики корзин, сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {bucket_count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+def render_prometheus() -> str:
+    """Все метрики реестра в текстовом формате Prometheus."""
+    return "\n".join(metric.render() for metric in _REGISTRY) + "\n"
+
+# --- Метрики пайплайна ---
+STAGE_SECONDS = Histogram(
+    "medscreen_stage_seconds", "Длительность этапа обработки (секунды).", labelnames=("stage",)
+)
+SLICES_PER_STUDY = Histogram(
+    "medscreen_slices_per_study", "Срезов на исследование: всего, выбрано для оценки, прошло через модель, взято у дубликата.",
+    buckets=(1, 10, 25, 50, 100, 200, 400, 600, 1000, 2000), labelnames=("kind",)
+)
+BATCH_SIZE = Histogram(
+    "medscreen_model_batch_size", "Число срезов в батче модели.", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+OOM_RETRIES = Counter(
+    "medscreen_model_oom_retries_total", "Батчи, повторенные с меньшим размером из-за нехватки памяти."
+)
+CACHE_REQUESTS = Counter(
+    "medscreen_result_cache_requests_total", "Обращения к кэшу результатов инференса.", labelnames=("result",)
+)
+JOB_QUEUE_DEPTH = Gauge("medscreen_job_queue_depth", "Заданий в очереди.")
+JOBS = Gauge("medscreen_jobs", "Заданий в памяти по статусам.", labelnames=("status",))
+
+@contextmanager
+def stage_timer(stage: str):
+    """Замеряет длительность блока и пишет ее в STAGE_SECONDS с меткой stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
@@ -5,24 +5,60 @@
 #   run_inference(volume_3d: np.ndarray, threshold: float = 0.1) -> Dict[str, Any]
 #
 # Вход:
-#   - volume_3d: 3D-массив numpy (срезы, высота, ширина).
+#   - volume_3d: 3D-массив numpy (срезы, высота, ширина) или LazyDicomVolume.
 #   - threshold: Порог для бинаrizации вероятностей (0.0-1.0).
 #
+# Режимы оценки среза (scoring_mode):
+#   - "generate": модель генерирует ответ, в тексте ищется 'anomaly' (вероятность 0 или 1).
+#   - "logits": один прямой проход, вероятность берется из логитов меток normal/anomaly.
+#     С prefix_cache=True KV-кэш общего префикса промпта (system + user) считается один раз
+#     и переиспользуется: через модель проходят только изображение и окончание промпта.
+#
+# Мозаика (mosaic_grid > 1, только "generate"): до mosaic_grid^2 соседних подготовленных срезов
+# раскладываются в одно изображение и оцениваются одним промптом; ответ по каждой плитке
+# относится к своему срезу. Если ответ не разобран на все плитки, эти срезы оцениваются по одному.
+# Сравнение с оценкой по срезам: `python -m benchmarks.compare_mosaic`.
+# Выборка срезов, кадрирование и уменьшение, дедупликация, ранняя остановка и агрегация по исследованию -
+# в базовом классе `StudyInference` (`study_inference.py`).
+#
 # Выход (словарь):
-#   - "preds": list[bool] - Бинарные предсказания для каждого среза.
-#   - "raw_probs": list[float] - "Сырые" вероятности патологии для каждого среза.
-#   - "processing_time": float - Общее время обработки в секундах.
+#   - "study_has_pathology": bool - Итоговое решение по исследованию.
+#   - "study_prob_pathology": float - Итоговая вероятность патологии (при early_exited - по оцененным срезам).
+#   - "study_processing_time": float - Общее время обработки в секундах.
+#   - "pred_slices": list[bool] - Бинарные предсказания для каждого среза.
+#   - "prob_slices": list[float | None] - Вероятности патологии (None для невыбранных срезов).
+#   - "slices_sampled": int - Сколько срезов выбрано для оценки.
+#   - "slices_evaluated": int - Сколько из них реально прошло через модель.
+#   - "slices_deduplicated": int - Сколько получили предсказание почти одинакового соседа (без модели).
+#   - "early_exited": bool - Ранняя остановка: оценены не все выбранные срезы.
+#   - "batch_size": int - Размер батча модели после обработки исследования.
+#   - "oom_retries": int - Сколько батчей повторено с меньшим размером из-за нехватки памяти.
+#
+# Размер батча: при нехватке памяти батч делится пополам и повторяется (исследование не теряется);
+# с batch_autotune=True при прогреве подбирается наибольший размер, который помещается в память
+# и еще ускоряет обработку.
 # ---
 
+import copy
 import logging
+import os
+import threading
 import time
 import numpy as np
 import torch
 from PIL import Image
 from transformers import pipeline
-from typing import Dict, List, Any
+from typing import Dict, List, Any, NamedTuple, Optional, Union
 import re
 
+from app.batching import MicroBatchScheduler
+from app.metrics import stage_timer, BATCH_SIZE as BATCH_SIZE_HISTOGRAM, OOM_RETRIES
+from app.preprocessing import tile_mosaic
+from app.study_inference import (
+    StudyInference, BATCH_SIZE, AGGREGATION, EARLY_EXIT, EARLY_EXIT_MARGIN, EARLY_EXIT_MIN_SLICES, DEDUP_TOLERANCE,
+    CROP_TO_BODY, MAX_SIDE
+)
+
 # --- ЛОГИРОВАНИЕ ---
 model_logger = logging.getLogger('model_logger')
 model_logger.setLevel(logging.INFO)
@@ -40,29 +76,59 @@ def get_gpu_memory_usage_str() -> str:
     peak = torch.cuda.max_memory_allocated() / 1024**2
     return f"GPU Mem: {allocated:.1f}MB (Peak: {peak:.1f}MB)"
 
-# --- Вспомогательные функции для выборки срезов ---
-def select_step(n_slices: int) -> int:
-    if n_slices < 50:   return 1
-    if n_slices < 100:  return 2
-    if n_slices < 200:  return 4
-    if n_slices < 400:  return 6
-    if n_slices < 600:  return 8
-    return 10
-
-def quartile_sample_indices(n_files: int, n: int) -> list[int]:
-    if n == 0: n = 1
-    q1, q2, q3 = n_files // 4, n_files // 2, (3 * n_files) // 4
-    idx = set()
-    idx.update(range(0, q1, n))
-    idx.update(range(q1, q2, max(1, n//2)))
-    idx.update(range(q2, q3, max(1, n//2)))
-    idx.update(range(q3, n_files, n))
-    if n_files > 0:
-        idx.add(n_files - 1)
-    return sorted(list(idx))
-
-class PathologyClassifier:
-    def __init__(self, model_name: str = "google/medgemma-4b-it"):
+# --- Параметры батчинга ---
+# Размер батча - MEDSCREEN_BATCH_SIZE (BATCH_SIZE в study_inference)
+# Общий планировщик, собирающий срезы одновременных исследований в полные батчи
+MICRO_BATCHING = os.getenv("MEDSCREEN_MICRO_BATCHING", "0") == "1"
+# Сколько планировщик ждет срезы для неполного батча (мс)
+BATCH_MAX_WAIT_MS = float(os.getenv("MEDSCREEN_BATCH_MAX_WAIT_MS", "10"))
+# Подбирать размер батча при прогреве (удвоением, пока хватает памяти и растет скорость)
+BATCH_AUTOTUNE = os.getenv("MEDSCREEN_BATCH_AUTOTUNE", "0") == "1"
+# Верхняя граница размера батча при подборе
+BATCH_SIZE_MAX = int(os.getenv("MEDSCREEN_BATCH_SIZE_MAX", "32"))
+
+# --- Параметры оценки ---
+# "generate" - генерация текста, "logits" - один прямой проход по логитам меток
+SCORING_MODE = os.getenv("MEDSCREEN_SCORING_MODE", "generate")
+# Переиспользовать KV-кэш общего префикса промпта (только для режима "logits")
+PREFIX_CACHE = os.getenv("MEDSCREEN_PREFIX_CACHE", "0") == "1"
+# Сторона мозаики: 2 - четыре соседних среза (2x2) в одном промпте; 1 - по одному срезу
+MOSAIC_GRID = int(os.getenv("MEDSCREEN_MOSAIC_GRID", "1"))
+# Токенов ответа на одну плитку мозаики ("panel 1: label: anomaly")
+MOSAIC_TOKENS_PER_TILE = 12
+
+class _Mosaic(NamedTuple):
+    """Мозаика соседних срезов для одного промпта."""
+    image: Image.Image
+    slices: List[Image.Image]
+
+class PathologyClassifier(StudyInference):
+    def __init__(self, model_name: str = "google/medgemma-4b-it", batch_size: int = BATCH_SIZE,
+                 micro_batching: bool = MICRO_BATCHING, max_wait_ms: float = BATCH_MAX_WAIT_MS,
+                 scoring_mode: str = SCORING_MODE, aggregation: str = AGGREGATION,
+                 prefix_cache: bool = PREFIX_CACHE, early_exit: bool = EARLY_EXIT,
+                 early_exit_margin: float = EARLY_EXIT_MARGIN, early_exit_min_slices: int = EARLY_EXIT_MIN_SLICES,
+                 dedup_tolerance: float = DEDUP_TOLERANCE, batch_autotune: bool = BATCH_AUTOTUNE,
+                 batch_size_max: int = BATCH_SIZE_MAX, crop_to_body: bool = CROP_TO_BODY, max_side: int = MAX_SIDE,
+                 mosaic_grid: int = MOSAIC_GRID):
+        if scoring_mode not in ("generate", "logits"):
+            raise ValueError(f"Неизвестный режим оценки: {scoring_mode}")
+        if prefix_cache and scoring_mode != "logits":
+            raise ValueError("Кэш префикса промпта поддерживается только в режиме оценки 'logits'.")
+        if mosaic_grid < 1:
+            raise ValueError(f"Некорректная сторона мозаики: {mosaic_grid}")
+        if mosaic_grid > 1 and scoring_mode != "generate":
+            raise ValueError("Мозаика поддерживается только в режиме оценки 'generate'.")
+        super().__init__(batch_size, aggregation, early_exit, early_exit_margin, early_exit_min_slices, dedup_tolerance,
+                         crop_to_body, max_side)
+        self.model_name = model_name
+        self.scoring_mode = scoring_mode
+        self.prefix_cache = prefix_cache
+        self.batch_autotune = batch_autotune
+        self.batch_size_max = batch_size_max
+        self.mosaic_grid = mosaic_grid
+        # (input_ids префикса, KV-кэш префикса) - считаются при первом батче
+        self._prefix_state = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.torch_dtype = torch.bfloat16 if self.device == "cuda" else torch.float32
         
@@ -91,80 +157,270 @@ Steps:
 4) Output format:
    - label: normal OR label: anomaly"""
         self.system_prompt = "You are an expert radiologist."
+        # Промпт мозаики: {tiles} и {grid} подставляются по числу срезов в ней
+        self.mosaic_prompt = """Task: the image is a {grid}x{grid} grid of {tiles} neighbouring chest CT slices (panels), numbered 1 to {tiles} left to right, top to bottom.
+Classify each panel separately for pulmonary abnormalities: opacities, consolidations, ground-glass changes, pleural effusion, pneumothorax, fibrosis, or nodules.
+Output format: one line per panel, in order:
+   - panel N: label: normal OR panel N: label: anomaly"""
+        # Начало ответа модели в режиме "logits": следующий токен - метка
+        self.label_prefix = "label:"
+        self._label_token_ids = self._get_label_token_ids() if scoring_mode == "logits" else None
+        # Модель вызывается из нескольких потоков API: сами вызовы сериализуем,
+        # а подготовка срезов идет параллельно
+        self._model_lock = threading.Lock()
+        # В режиме микро-батчинга срезы всех исследований идут через один планировщик
+        self.scheduler = MicroBatchScheduler(self._predict_batch, batch_size, max_wait_ms) if micro_batching else None
 
-    def _prepare_slice(self, slice_2d: np.ndarray) -> Image.Image:
-        """Конвертирует 2D срез в PIL Image."""
-        # Применяем легочное окно, как в скрипте коллеги
-        center, width = -600, 1500
-        lo, hi = center - width / 2, center + width / 2
-        slice_2d = np.clip(slice_2d, lo, hi)
-        slice_2d = (slice_2d - lo) / (hi - lo + 1e-6)
-        
-        # Нормализуем в uint8
-        slice_2d = np.clip(slice_2d, 0, 1)
-        img_array = (slice_2d * 255).astype(np.uint8)
-        return Image.fromarray(img_array).convert("L")
+    @property
+    def model_signature(self) -> Dict[str, Any]:
+        """Все, что влияет на оценку одного среза (модель, промпты, режим)."""
+        return {
+            "model_name": self.model_name,
+            "system_prompt": self.system_prompt,
+            "user_prompt": self.user_prompt,
+            "max_new_tokens": 10,
+            "scoring_mode": self.scoring_mode,
+            "mosaic_grid": self.mosaic_grid,
+            "mosaic_prompt": self.mosaic_prompt if self.mosaic_grid > 1 else None,
+        }
 
-    @torch.inference_mode()
-    def run_inference(self, volume_3d: np.ndarray, threshold: float = 0.1) -> Dict[str, Any]:
+    def _get_label_token_ids(self) -> Dict[str, int]:
+        """Id первых токенов меток normal/anomaly, как они идут после 'label:'."""
+        tokenizer = self.pipe.processor.tokenizer
+        token_ids = {label: tokenizer.encode(" " + label, add_special_tokens=False)[0] for label in ("normal", "anomaly")}
+        if token_ids["normal"] == token_ids["anomaly"]:
+            raise ValueError("Метки normal и anomaly начинаются с одного токена: режим 'logits' недоступен.")
+        return token_ids
+
+    def warm_up(self) -> None:
+        """Прогоняет через модель фиктивный батч: первые запросы не платят за ленивую инициализацию."""
         start_time = time.time()
-        
-        # 1. Выборка и подготовка срезов
-        num_total_slices = volume_3d.shape[0]
-        step = select_step(num_total_slices)
-        indices_to_process = quartile_sample_indices(num_total_slices, step)
-        
-        slices_to_process = [self._prepare_slice(volume_3d[i]) for i in indices_to_process]
-
-        if not slices_to_process:
-            return {
-                'study_has_pathology': False, 'study_prob_pathology': 0.0,
-                'study_processing_time': 0.0, 'pred_slices': []
-            }
-
-        # 2. --- ИЗМЕНЕНИЕ: Формирование батча в формате чата ---
-        batch_messages = []
-        for image in slices_to_process:
-            messages = [
-                {"role": "system", "content": [{"type": "text", "text": self.system_prompt}]},
-                {"role": "user", "content": [{"type": "text", "text": self.user_prompt}, {"type": "image", "image": image}]}
-            ]
-            batch_messages.append(messages)
+        if self.batch_autotune:
+            self.autotune_batch_size()
+        else:
+            self._predict_batch([Image.new("L", (512, 512))] * self.batch_size)
+        model_logger.info(f"Прогрев модели занял {time.time() - start_time:.1f}с {get_gpu_memory_usage_str()}")
+
+    @torch.inference_mode()
+    def autotune_batch_size(self) -> int:
+        """
+        Подбирает размер батча на фиктивных срезах: удваивает его, пока батч помещается в память
+        и время на срез заметно падает. Возвращает выбранный размер.
+        """
+        size = max(1, min(self.batch_size, self.batch_size_max))
+        best_size, best_per_image = size, None
+        while size <= self.batch_size_max:
+            self.batch_size = size
+            images = [Image.new("L", (512, 512))] * size
+            try:
+                # Первый проход на новом размере - прогрев, замеряется второй
+                self._run_chunk(images)
+                start_time = time.perf_counter()
+                self._run_chunk(images)
+                per_image = (time.perf_counter() - start_time) / size
+            except RuntimeError as e:
+                if not self._is_oom(e):
+                    raise
+                self._free_memory()
+                model_logger.info(f"Подбор батча: размер {size} не помещается в память")
+                break
+            model_logger.info(f"Подбор батча: размер {size}, {per_image * 1000:.0f} мс на срез")
+            if best_per_image is not None and per_image > best_per_image * 0.9:
+                break
+            best_size, best_per_image = size, per_image
+            size *= 2
+
+        self._set_batch_size(best_size)
+        model_logger.info(f"Выбран размер батча {best_size} {get_gpu_memory_usage_str()}")
+        return best_size
 
-        # 3. Запуск инференса
-        outputs = self.pipe(
-            batch_messages,
-            max_new_tokens=10, # Достаточно для "label: anomaly"
-            batch_size=4 # Оставляем батчинг для скорости
+    def _set_batch_size(self, size: int) -> None:
+        self.batch_size = size
+        if self.scheduler is not None:
+            self.scheduler.max_batch_size = size
+
+    @staticmethod
+    def _is_oom(error: BaseException) -> bool:
+        """Ошибка нехватки памяти ускорителя (CUDA OOM или аналогичная ошибка аллокатора)."""
+        return isinstance(error, torch.cuda.OutOfMemoryError) or "out of memory" in str(error).lower()
+
+    @staticmethod
+    def _free_memory() -> None:
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _on_oom(self, failed_size: int) -> None:
+        """Уменьшает размер батча вдвое после нехватки памяти."""
+        self._free_memory()
+        self.oom_retries += 1
+        OOM_RETRIES.inc()
+        # Другой поток мог уже уменьшить размер: делим только то, что упало
+        self._set_batch_size(max(1, min(self.batch_size, failed_size // 2)))
+        model_logger.warning(
+            f"Нехватка памяти на батче из {failed_size} срезов: размер батча уменьшен до {self.batch_size}, "
+            f"батч повторяется {get_gpu_memory_usage_str()}"
         )
 
-        # 4. Парсинг результатов
-        slice_preds = []
-        for output in outputs:
-            # Извлекаем последний ответ модели
-            text_content = output[0]['generated_text'][-1]['content']
-            # Ищем 'anomaly' в ответе, это надежнее, чем парсить 'label:'
-            is_anomaly = 'anomaly' in text_content.lower()
-            slice_preds.append(is_anomaly)
-
-        # 5. Агрегация и возврат результата в старом формате
-        num_pathology_slices = sum(slice_preds)
-        total_processed = len(slice_preds)
-        
-        study_prob_pathology = (num_pathology_slices / total_processed) if total_processed > 0 else 0.0
-        study_has_pathology = study_prob_pathology >= threshold
+    def predict_images(self, images: List[Image.Image]) -> List[float]:
+        """В режиме мозаики соседние срезы идут в модель по mosaic_grid^2 в одном промпте."""
+        if self.mosaic_grid <= 1:
+            return super().predict_images(images)
+        tiles = self.mosaic_grid ** 2
+        with stage_timer("mosaic"):
+            mosaics = [
+                _Mosaic(tile_mosaic(images[start:start + tiles], self.mosaic_grid), images[start:start + tiles])
+                for start in range(0, len(images), tiles)
+            ]
+        # Мозаики идут тем же путем (батчи, планировщик, повтор при нехватке памяти), ответ - список по плиткам
+        return [prob for tile_probs in super().predict_images(mosaics) for prob in tile_probs]
 
-        # Создаем полный список предсказаний для всех срезов (False по умолчанию)
-        full_preds = [False] * num_total_slices
-        for i, pred_idx in enumerate(indices_to_process):
-            if slice_preds[i]:
-                full_preds[pred_idx] = True
+    def _build_messages(self, item: Union[Image.Image, _Mosaic]) -> List[Dict[str, Any]]:
+        """Сообщения чата для одного среза или мозаики."""
+        if isinstance(item, _Mosaic):
+            text = self.mosaic_prompt.format(grid=self.mosaic_grid, tiles=len(item.slices))
+            image = item.image
+        else:
+            text, image = self.user_prompt, item
+        return [
+            {"role": "system", "content": [{"type": "text", "text": self.system_prompt}]},
+            {"role": "user", "content": [{"type": "text", "text": text}, {"type": "image", "image": image}]}
+        ]
 
-        processing_time = time.time() - start_time
+    @staticmethod
+    def _parse_tile_labels(text: str, tiles: int) -> Optional[List[float]]:
+        """Метки плиток из ответа на мозаику; None, если ответ не покрывает все плитки."""
+        text = text.lower()
+        numbered = {int(num): label for num, label in re.findall(r"panel\s*(\d+)\s*:\s*(?:label\s*:\s*)?(normal|anomaly)", text)}
+        if all(num in numbered for num in range(1, tiles + 1)):
+            labels = [numbered[num] for num in range(1, tiles + 1)]
+        else:
+            # Без номеров: метки по порядку строк
+            labels = re.findall(r"normal|anomaly", text)
+            if len(labels) != tiles:
+                return None
+        return [1.0 if label == "anomaly" else 0.0 for label in labels]
 
-        return {
-            "study_has_pathology": study_has_pathology,
-            "study_prob_pathology": study_prob_pathology,
-            "study_processing_time": processing_time,
-            "pred_slices": full_preds
-        }
\ No newline at end of file
+    @torch.inference_mode()
+    def _predict_batch(self, images: List[Image.Image]) -> List[Any]:
+        """
+        Прогоняет подготовленные срезы (или мозаики) через модель батчами по batch_size и возвращает
+        вероятности патологии (для мозаики - список по плиткам). При нехватке памяти батч
+        уменьшается вдвое и повторяется.
+        """
+        slice_probs = []
+        start = 0
+        while start < len(images):
+            chunk = images[start:start + self.batch_size]
+            try:
+                slice_probs.extend(self._run_chunk(chunk))
+            except RuntimeError as e:
+                if not self._is_oom(e) or len(chunk) == 1:
+                    raise
+                self._on_oom(len(chunk))
+                continue
+            start += len(chunk)
+        return slice_probs
+
+    def _run_chunk(self, chunk: List[Image.Image]) -> List[Any]:
+        """Один батч модели в текущем режиме оценки."""
+        BATCH_SIZE_HISTOGRAM.observe(len(chunk))
+        if self.scoring_mode == "logits":
+            return self._score_chunk(chunk)
+        return self._generate_chunk(chunk)
+
+    def _generate_chunk(self, chunk: List[Union[Image.Image, _Mosaic]]) -> List[Any]:
+        """
+        Режим "generate": модель генерирует ответ, в тексте ищется 'anomaly'.
+        Для мозаики возвращает список вероятностей по ее плиткам.
+        """
+        # Формирование батча в формате чата
+        batch_messages = [self._build_messages(item) for item in chunk]
+        max_tiles = max(len(item.slices) if isinstance(item, _Mosaic) else 1 for item in chunk)
+        with self._model_lock, stage_timer("model_batch"):
+            outputs = self.pipe(
+                batch_messages,
+                # Для одного среза 10 достаточно для "label: anomaly"
+                max_new_tokens=10 if max_tiles == 1 else MOSAIC_TOKENS_PER_TILE * max_tiles,
+                batch_size=len(batch_messages)
+            )
+
+        slice_probs = []
+        unparsed = []
+        with stage_timer("parse_output"):
+            for item, output in zip(chunk, outputs):
+                # Извлекаем последний ответ модели
+                text_content = output[0]['generated_text'][-1]['content']
+                if isinstance(item, _Mosaic):
+                    tile_probs = self._parse_tile_labels(text_content, len(item.slices))
+                    if tile_probs is None:
+                        unparsed.append(len(slice_probs))
+                    slice_probs.append(tile_probs)
+                    continue
+                # Ищем 'anomaly' в ответе, это надежнее, чем парсить 'label:'
+                is_anomaly = 'anomaly' in text_content.lower()
+                slice_probs.append(1.0 if is_anomaly else 0.0)
+
+        for pos in unparsed:
+            # Ответ не покрывает все плитки: срезы этой мозаики оцениваются по одному
+            model_logger.warning(f"Ответ на мозаику из {len(chunk[pos].slices)} срезов не разобран, оценка по срезам")
+            slice_probs[pos] = self._generate_chunk(chunk[pos].slices)
+        return slice_probs
+
+    def _score_chunk(self, chunk: List[Image.Image]) -> List[float]:
+        """
+        Режим "logits": один прямой проход на батч без авторегрессионной генерации.
+        Вероятность патологии - softmax по логитам токенов normal/anomaly после 'label:'.
+        """
+        processor = self.pipe.processor
+        label_ids = [self._label_token_ids["normal"], self._label_token_ids["anomaly"]]
+        texts = [
+            processor.apply_chat_template(self._build_messages(image), add_generation_prompt=True, tokenize=False) + self.label_prefix
+            for image in chunk
+        ]
+        # Паддинг слева: последняя позиция каждой строки - конец промпта
+        inputs = processor(
+            text=texts, images=[[image] for image in chunk],
+            padding=True, padding_side="left", return_tensors="pt"
+        ).to(self.pipe.model.device, dtype=self.torch_dtype)
+        with self._model_lock, stage_timer("model_batch"):
+            if self.prefix_cache:
+                logits = self._forward_with_prefix_cache(inputs)
+            else:
+                logits = self.pipe.model(**inputs, logits_to_keep=1).logits[:, -1, :]
+        with stage_timer("parse_output"):
+            label_logits = logits[:, label_ids].float()
+            return torch.softmax(label_logits, dim=-1)[:, 1].tolist()
+
+    def _forward_with_prefix_cache(self, inputs) -> torch.Tensor:
+        """
+        Прямой проход, в котором общий префикс (все токены до изображения) берется
+        из заранее посчитанного KV-кэша. Возвращает логиты последней позиции.
+        """
+        input_ids, attention_mask = inputs["input_ids"], inputs["attention_mask"]
+        image_positions = (input_ids[0] == self.pipe.model.config.image_token_id).nonzero()
+        if len(image_positions) == 0 or not bool(attention_mask.all()):
+            # Нет изображения или есть паддинг: префиксы строк не совпадают
+            return self.pipe.model(**inputs, logits_to_keep=1).logits[:, -1, :]
+        prefix_len = int(image_positions[0])
+        prefix_ids = input_ids[:, :prefix_len]
+
+        if self._prefix_state is None or not torch.equal(self._prefix_state[0], prefix_ids[0]):
+            prefix_outputs = self.pipe.model(input_ids=prefix_ids[:1], use_cache=True)
+            self._prefix_state = (prefix_ids[0].clone(), prefix_outputs.past_key_values)
+        if not torch.equal(prefix_ids, self._prefix_state[0].expand_as(prefix_ids)):
+            return self.pipe.model(**inputs, logits_to_keep=1).logits[:, -1, :]
+
+        # Копия кэша префикса, размноженная на батч: прямой проход дописывает в нее суффикс
+        past_key_values = copy.deepcopy(self._prefix_state[1])
+        past_key_values.batch_repeat_interleave(input_ids.shape[0])
+        outputs = self.pipe.model(
+            input_ids=input_ids[:, prefix_len:],
+            pixel_values=inputs["pixel_values"],
+            # Маска и token_type_ids - на всю длину: позиции в масках абсолютные
+            attention_mask=attention_mask,
+            token_type_ids=inputs.get("token_type_ids"),
+            past_key_values=past_key_values,
+            cache_position=torch.arange(prefix_len, input_ids.shape[1], device=input_ids.device),
+            logits_to_keep=1,
+        )
+        return outputs.logits[:, -1, :]
@@ -1,17 +1,23 @@
 import streamlit as st
-from app.ml_inference import PathologyClassifier
-from typing import Dict, Any
+from app.result_cache import run_cached_inference
+from app.model_client import load_classifier
+from app.study_inference import StudyInference
+from typing import Dict, Any, Optional
 import numpy as np
 
 @st.cache_resource
-def get_model() -> PathologyClassifier:
-    """Загружает и кэширует ML-модель."""
-    return PathologyClassifier()
+def get_model() -> StudyInference:
+    """Загружает и кэширует ML-модель (или клиент модельного сервера)."""
+    # torch и transformers импортируются при первом обращении к локальной модели, а не при открытии страницы
+    return load_classifier()
 
+# Объем не хэшируется (аргумент с "_"): ключ кэша - отпечаток серии, посчитанный при парсинге
 @st.cache_data(show_spinner="Анализ срезов моделью...")
-def run_pathology_inference(_model: PathologyClassifier, volume_3d: np.ndarray, threshold: float = 0.1) -> Dict[str, Any]:
+def run_pathology_inference(_model: StudyInference, _volume_3d: np.ndarray, fingerprint: str, threshold: float = 0.1,
+                            archive_hash: Optional[str] = None, series_uid: str = "") -> Dict[str, Any]:
     """
     Кэшируемая обертка для запуска инференса модели.
+    Поверх кэша Streamlit использует дисковый кэш, общий с API.
     Возвращает словарь с результатами.
     """
-    return _model.run_inference(volume_3d, threshold=threshold)
\ No newline at end of file
+    return run_cached_inference(_model, _volume_3d, archive_hash, series_uid, threshold=threshold)
@@ -0,0 +1,140 @@
+# --- Клиент модельного сервера ---
+#
+# Флоу:
+# 1. `load_classifier` выбирает реализацию: если задан MEDSCREEN_MODEL_SERVER_URL -
+#    `RemoteClassifier` (веса держит один процесс `model_server.py`), иначе локальный
+#    `PathologyClassifier` (torch импортируется только в этом случае).
+# 2. `RemoteClassifier.run_inference` - тот же контракт, что у локальной модели:
+#    выборка, подготовка, дедупликация и агрегация идут на стороне клиента
+#    (`StudyInference`), а на сервер уходят только подготовленные выбранные срезы.
+# 3. Транспорт - HTTP через Unix-сокет ("unix:///run/medscreen/model.sock")
+#    или localhost ("http://127.0.0.1:8600"). Срезы передаются одним .npy-массивом uint8.
+
+import http.client
+import io
+import json
+import os
+import socket
+import time
+import urllib.parse
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.metrics import stage_timer
+from app.study_inference import StudyInference
+
+# Адрес модельного сервера; пусто - модель загружается в этом процессе
+MODEL_SERVER_URL = os.getenv("MEDSCREEN_MODEL_SERVER_URL", "")
+# Сколько ждать готовности модельного сервера и ответа на запрос (секунды)
+MODEL_SERVER_TIMEOUT = float(os.getenv("MEDSCREEN_MODEL_SERVER_TIMEOUT", "600"))
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP-соединение через Unix-сокет."""
+
+    def __init__(self, socket_path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+class RemoteClassifier(StudyInference):
+    """Классификатор, который оценивает срезы на модельном сервере."""
+
+    def __init__(self, url: str = MODEL_SERVER_URL, timeout: float = MODEL_SERVER_TIMEOUT, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+        self._server_info: Optional[Dict[str, Any]] = None
+        # Размер батча на сервере по последнему ответу (меняется при нехватке памяти)
+        self._server_batch_size: Optional[int] = None
+
+    def _request(self, method: str, path: str, body: Optional[bytes] = None,
+                 content_type: str = "application/json") -> Tuple[int, bytes]:
+        parsed = urllib.parse.urlsplit(self.url)
+        if parsed.scheme == "unix":
+            connection = _UnixHTTPConnection(parsed.path, self.timeout)
+        else:
+            connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self.timeout)
+        try:
+            connection.request(method, path, body=body, headers={"Content-Type": content_type})
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+
+    def wait_ready(self, timeout: Optional[float] = None) -> None:
+        """Ждет, пока модельный сервер загрузит модель; по таймауту - RuntimeError."""
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        last_error = "нет ответа"
+        while time.monotonic() < deadline:
+            try:
+                status, body = self._request("GET", "/health/ready")
+                if status == 200:
+                    return
+                state = json.loads(body)
+                last_error = state.get("error") or f"статус {state.get('status')}"
+                if state.get("status") == "failed":
+                    break
+            except (OSError, http.client.HTTPException) as e:
+                last_error = str(e)
+            time.sleep(1.0)
+        raise RuntimeError(f"Модельный сервер {self.url} не готов: {last_error}")
+
+    @property
+    def server_info(self) -> Dict[str, Any]:
+        """Подпись модели и параметры сервера (запрашиваются один раз)."""
+        if self._server_info is None:
+            self.wait_ready()
+            status, body = self._request("GET", "/info")
+            if status != 200:
+                raise RuntimeError(f"Модельный сервер вернул HTTP {status}: {body[:200]!r}")
+            self._server_info = json.loads(body)
+        return self._server_info
+
+    @property
+    def model_signature(self) -> Dict[str, Any]:
+        return self.server_info["model_signature"]
+
+    @property
+    def model_batch_size(self) -> int:
+        if self._server_batch_size is None:
+            return self.server_info["batch_size"]
+        return self._server_batch_size
+
+    def predict_images(self, images: List[Image.Image]) -> List[float]:
+        """Отправляет подготовленные срезы на сервер и возвращает вероятности патологии."""
+        if not images:
+            return []
+        with io.BytesIO() as buffer:
+            np.save(buffer, np.stack([np.asarray(image, dtype=np.uint8) for image in images]), allow_pickle=False)
+            payload = buffer.getvalue()
+        with stage_timer("model_request"):
+            status, body = self._request("POST", "/predict", payload, "application/octet-stream")
+        if status != 200:
+            raise RuntimeError(f"Модельный сервер вернул HTTP {status}: {body[:200]!r}")
+        response = json.loads(body)
+        self._server_batch_size = response.get("batch_size", self._server_batch_size)
+        self.oom_retries += response.get("oom_retries", 0)
+        return response["probs"]
+
+    def warm_up(self) -> None:
+        """Прогрев делает сам сервер; клиент только дожидается его готовности."""
+        self.wait_ready()
+
+def load_classifier(warm_up: bool = False):
+    """Клиент модельного сервера (если задан его адрес) или локальная модель."""
+    if MODEL_SERVER_URL:
+        classifier = RemoteClassifier()
+        classifier.wait_ready()
+        return classifier
+    # torch и transformers нужны только локальной модели
+    from app.ml_inference import PathologyClassifier
+    classifier = PathologyClassifier()
+    if warm_up:
+        classifier.warm_up()
+    return classifier
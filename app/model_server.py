@@ -0,0 +1,87 @@
+# --- Модельный сервер: один процесс держит веса для UI и API ---
+#
+# Запуск:
+#   uvicorn app.model_server:app --uds /run/medscreen/model.sock   # Unix-сокет
+#   uvicorn app.model_server:app --host 127.0.0.1 --port 8600      # localhost HTTP
+#
+# Флоу:
+# 1. При старте в фоне загружает и прогревает `PathologyClassifier`
+#    (по умолчанию с общим планировщиком микро-батчей: срезы одновременных
+#    запросов UI и API попадают в одни батчи).
+# 2. `POST /predict` принимает подготовленные срезы (.npy-массив uint8 [срезы, высота, ширина])
+#    и возвращает {"probs": [...]} - вероятность патологии для каждого среза, а также
+#    текущий размер батча и число повторов из-за нехватки памяти за время запроса.
+# 3. `GET /info` отдает подпись модели для ключей кэша клиентов, `/health/*` - состояние,
+#    `/metrics` - метрики модели (длительности и размеры батчей).
+#
+# Клиент - `RemoteClassifier` из `model_client.py`.
+
+import io
+import os
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from PIL import Image
+
+from app.metrics import render_prometheus
+from app.model_state import BackgroundModel
+
+# На сервере микро-батчинг включен по умолчанию: к нему обращаются несколько процессов
+MICRO_BATCHING = os.getenv("MEDSCREEN_MICRO_BATCHING", "1") == "1"
+# Прогревать модель фиктивным батчем после загрузки
+WARMUP = os.getenv("MEDSCREEN_WARMUP", "1") == "1"
+
+app = FastAPI(title="MedScreen Model Server", description="Общая модель для UI и API.", version="1.0.0")
+
+def _load_model():
+    """Загружает и прогревает модель (в фоновом потоке `model_state`)."""
+    from app.ml_inference import PathologyClassifier
+    classifier = PathologyClassifier(micro_batching=MICRO_BATCHING)
+    if WARMUP:
+        classifier.warm_up()
+    return classifier
+
+model_state = BackgroundModel(_load_model)
+
+
+@app.on_event("startup")
+def startup():
+    model_state.start()
+
+
+model_state.add_health_routes(app)
+
+
+@app.get("/info", tags=["Model"])
+def info():
+    """Подпись модели (входит в ключи кэша результатов клиентов) и размер батча."""
+    ready_model = model_state.require()
+    return {"model_signature": ready_model.model_signature, "batch_size": ready_model.batch_size}
+
+
+@app.post("/predict", tags=["Model"])
+async def predict(request: Request):
+    """Вероятности патологии для подготовленных срезов (.npy-массив uint8 [срезы, высота, ширина])."""
+    ready_model = model_state.require()
+    try:
+        slices = np.load(io.BytesIO(await request.body()), allow_pickle=False)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Некорректный массив срезов: {e}")
+    if slices.dtype != np.uint8 or slices.ndim != 3:
+        raise HTTPException(status_code=400, detail="Ожидается массив uint8 формы [срезы, высота, ширина].")
+
+    images = [Image.fromarray(slice_2d) for slice_2d in slices]
+    # Синхронная модель - в пуле потоков: одновременные запросы собираются планировщиком в батчи
+    oom_retries_before = ready_model.oom_retries
+    probs = await run_in_threadpool(ready_model.predict_images, images)
+    return {
+        "probs": [float(prob) for prob in probs],
+        "batch_size": ready_model.batch_size,
+        "oom_retries": ready_model.oom_retries - oom_retries_before,
+    }
+
+
+@app.get("/metrics", tags=["Monitoring"], response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
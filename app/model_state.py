@@ -0,0 +1,86 @@
+# --- Фоновая загрузка модели и проверки готовности (общие для api.py и model_server.py) ---
+#
+# Флоу:
+# 1. `BackgroundModel.start` загружает модель в фоновом потоке: сервис сразу принимает запросы.
+# 2. Статус загрузки ("loading" -> "ready" / "failed") отдают `/health/ready` и ошибки 503.
+#    С retry_interval_s загрузка после ошибки повторяется (статус остается "loading", ошибка видна
+#    в "error"): так клиент модельного сервера дожидается сервера, сколько бы тот ни загружался.
+# 3. `require` - модель для синхронных запросов (503, пока не готова), `wait` - для фоновых
+#    заданий (ждет окончания загрузки; если она не удалась - RuntimeError).
+# 4. `add_health_routes` регистрирует `/health/live` и `/health/ready`.
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+
+class BackgroundModel:
+    """Модель, которая загружается в фоне, и ее статус."""
+
+    def __init__(self, load: Callable[[], Any], retry_interval_s: Optional[float] = None):
+        self._load_fn = load
+        self.retry_interval_s = retry_interval_s
+        # До старта модель можно подменить (например, заглушкой в бенчмарках)
+        self.model = None
+        self.status = {"status": "loading", "error": None}
+        # Загрузка завершена (успешно или окончательно с ошибкой)
+        self.loaded = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._load, name="medscreen-model-loader", daemon=True).start()
+
+    def _load(self) -> None:
+        """Загружает модель; с retry_interval_s повторяет попытки до успеха."""
+        logger = logging.getLogger('model_logger')
+        try:
+            while True:
+                try:
+                    if self.model is None:
+                        self.model = self._load_fn()
+                    self.status.update(status="ready", error=None)
+                    return
+                except Exception as e:
+                    if self.retry_interval_s is None:
+                        logger.error(f"Не удалось загрузить модель: {e}")
+                        self.status.update(status="failed", error=str(e))
+                        return
+                    logger.warning(f"Модель еще не загружена, повтор через {self.retry_interval_s:g} с: {e}")
+                    self.status["error"] = str(e)
+                    time.sleep(self.retry_interval_s)
+        finally:
+            self.loaded.set()
+
+    @property
+    def failed(self) -> bool:
+        return self.status["status"] == "failed"
+
+    def wait(self):
+        """Модель для фоновых заданий: ждет окончания загрузки; если она не удалась - RuntimeError."""
+        self.loaded.wait()
+        if self.failed:
+            raise RuntimeError(f"Модель не загружена: {self.status['error']}")
+        return self.model
+
+    def require(self):
+        """Модель для синхронных запросов; пока она не готова - 503."""
+        if self.status["status"] != "ready":
+            raise HTTPException(status_code=503, detail=f"Модель не готова (статус: {self.status['status']}).")
+        return self.model
+
+    def add_health_routes(self, app: FastAPI) -> None:
+        """`/health/live` - процесс жив; `/health/ready` - модель загружена (иначе 503 со статусом)."""
+
+        @app.get("/health/live", tags=["Health"])
+        def health_live():
+            """Процесс жив и принимает запросы (модель может еще загружаться)."""
+            return {"status": "alive"}
+
+        @app.get("/health/ready", tags=["Health"])
+        def health_ready():
+            """Модель загружена и прогрета; иначе 503 со статусом загрузки."""
+            if self.status["status"] != "ready":
+                return JSONResponse(status_code=503, content=self.status)
+            return self.status
@@ -1,10 +1,11 @@
 import streamlit as st
 import pandas as pd
 
-from app.file_io import parse_zip_archive
+from app.file_io import parse_zip_archive, compute_archive_hash
 from app.data_validation import validate_series
-from app.visualization import prepare_frames_for_display, create_gif
+from app.visualization import display_window, render_slice, submit_preview_animation, SliceRenderCache
 from app.ml_processing import get_model, run_pathology_inference
+from app.study_processing import run_series_inference
 
 # Окна визуализации для КТ (Center, Width)
 CT_WINDOWS = {
@@ -13,11 +14,42 @@ CT_WINDOWS = {
     "Костное (Bone)": (700, 1500),
 }
 
+# Как часто проверять, готова ли фоновая анимация (секунды)
+GIF_POLL_INTERVAL_S = 1.0
+
 def reset_session_state():
     """Сбрасывает состояние сессии при загрузке нового файла."""
     st.session_state.clear()
 
 
+def get_preview_animation(series_data: dict, window_name: str, window):
+    """Future фоновой сборки анимации для (серия, окно); запускается один раз за сессию."""
+    animation_futures = st.session_state.setdefault('animation_futures', {})
+    key = (series_data['fingerprint'], window_name)
+    if key not in animation_futures:
+        animation_futures[key] = submit_preview_animation(series_data['frames'], window)
+    return animation_futures[key]
+
+
+@st.fragment(run_every=GIF_POLL_INTERVAL_S)
+def _wait_for_animation(animation_future):
+    """Ждет фоновую анимацию, не блокируя страницу; когда она готова, перерисовывает страницу."""
+    if animation_future.done():
+        st.rerun()
+    st.info("Анимация готовится...")
+
+
+def show_animation(animation_future):
+    if not animation_future.done():
+        _wait_for_animation(animation_future)
+        return
+    animation_bytes, mime_type = animation_future.result()
+    if mime_type.startswith("video/"):
+        st.video(animation_bytes, format=mime_type, loop=True, autoplay=True, muted=True)
+    else:
+        st.image(animation_bytes, use_container_width=True)
+
+
 def show_about_page():
     st.title("ℹ️ О проекте")
     st.markdown("""
@@ -66,19 +98,15 @@ def show_preview_page():
         if not uploaded_file:
             return
 
-        if 'file_content' not in st.session_state:
-            st.session_state.file_content = uploaded_file.getvalue()
-
         if 'processed_data' not in st.session_state:
             with st.spinner("Идет обработка..."):
-                # Передаем в парсер содержимое файла, а не сам объект
-                data, error_message = parse_zip_archive(st.session_state.file_content)
+                # Передаем в парсер сам файловый объект: без лишней копии через getvalue()
+                data, error_message = parse_zip_archive(uploaded_file)
                 if error_message:
                     st.error(f"Ошибка чтения архива: {error_message}")
-                    # Очищаем, чтобы можно было попробовать снова с тем же файлом
-                    del st.session_state.file_content
                     return
                 st.session_state.processed_data = data
+                st.session_state.archive_hash = compute_archive_hash(uploaded_file)
                 st.rerun()
 
         # --- ЭТАП 2: Валидация данных ---
@@ -123,9 +151,17 @@ def show_preview_page():
     if st.session_state.get('show_visualization'):
         active_window = st.session_state.get('active_window_name')
         
-        display_frames = prepare_frames_for_display(series_data, active_window, CT_WINDOWS)
-        gif_bytes = create_gif(display_frames)
-        num_frames = len(display_frames)
+        frames = series_data['frames']
+        num_frames = len(frames)
+        # Окно считается один раз: для не-КТ это диапазон значений серии
+        fingerprint = series_data['fingerprint']
+        display_windows = st.session_state.setdefault('display_windows', {})
+        if (fingerprint, active_window) not in display_windows:
+            display_windows[(fingerprint, active_window)] = display_window(series_data, active_window, CT_WINDOWS)
+        window = display_windows[(fingerprint, active_window)]
+        # Анимация собирается в фоне, а срезы отрисовываются по одному при движении слайдера
+        animation_future = get_preview_animation(series_data, active_window, window)
+        slice_cache = st.session_state.setdefault('slice_cache', SliceRenderCache())
 
         if 'slice_idx' not in st.session_state:
             st.session_state.slice_idx = num_frames // 2
@@ -134,11 +170,15 @@ def show_preview_page():
 
         with vis_col1:
             st.subheader("Анимация")
-            st.image(gif_bytes, use_container_width=True)
+            show_animation(animation_future)
 
         with vis_col2:
             st.subheader("Предпросмотр среза")
-            st.image(display_frames[st.session_state.slice_idx], use_container_width=True)
+            slice_idx = st.session_state.slice_idx
+            frame = slice_cache.get_or_render(
+                (fingerprint, active_window, slice_idx), lambda: render_slice(frames, slice_idx, window)
+            )
+            st.image(frame, use_container_width=True)
             st.slider("Срез", 0, num_frames - 1, key='slice_idx', label_visibility="collapsed")
             st.caption(f"Показан срез: {st.session_state.slice_idx + 1} / {num_frames}")
 
@@ -147,7 +187,16 @@ def show_preview_page():
             if 'pathology_results' not in st.session_state:
                 if st.button("Найти патологии", type="primary", use_container_width=True):
                     model = get_model()
-                    results = run_pathology_inference(model, series_data['frames'])
+                    results, decode_error = run_series_inference(
+                        lambda: run_pathology_inference(
+                            model, series_data['frames'], series_data['fingerprint'],
+                            archive_hash=st.session_state.get('archive_hash'), series_uid=series_uid
+                        ),
+                        uploaded_file.name, series_uid
+                    )
+                    if decode_error:
+                        st.error(decode_error)
+                        st.stop()
                     st.session_state.pathology_results = results
                     st.session_state.study_has_pathology = results.get('study_has_pathology', False)
                     st.session_state.study_prob_pathology = results.get('study_prob_pathology', 0.0)
@@ -158,6 +207,13 @@ def show_preview_page():
                 # --- ИСПРАВЛЕНИЕ: Используем новые флаги из session_state ---
                 has_pathology = st.session_state.get('study_has_pathology', False)
                 final_prob = st.session_state.get('study_prob_pathology', 0.0)
+                results = st.session_state.pathology_results
+                if 'slices_evaluated' in results:
+                    st.caption(f"Оценено срезов: {results['slices_evaluated']} из {results['slices_sampled']} выбранных"
+                               + (f", еще {results['slices_deduplicated']} - по почти одинаковым соседям"
+                                  if results.get('slices_deduplicated') else ""))
+                if results.get('early_exited'):
+                    st.caption("Ранняя остановка: итоговая вероятность посчитана только по оцененным срезам.")
 
                 if not has_pathology:
                     st.success("Патологий не найдено.", icon="✅")
@@ -221,7 +277,8 @@ def show_batch_page():
                     progress_text = f"Анализ файла {i+1}/{len(uploaded_files)}: {file.name}..."
                     progress_bar.progress(i / len(uploaded_files), text=progress_text)
                     
-                    series_data, error_message = parse_zip_archive(file.getvalue())
+                    series_data, error_message = parse_zip_archive(file)
+                    archive_hash = compute_archive_hash(file) if series_data else None
 
                     if not series_data or error_message:
                         csv_data.append({'archive_name': file.name, 'is_valid': False, 'series_uid': error_message or "Parsing error"})
@@ -234,7 +291,15 @@ def show_batch_page():
 
                         if is_valid and len(data['frames']) > 0:
                             # ИСПРАВЛЕНИЕ: Используем локальную модель
-                            inference_results = run_pathology_inference(model, data['frames'])
+                            inference_results, decode_error = run_series_inference(
+                                lambda: run_pathology_inference(
+                                    model, data['frames'], data['fingerprint'], archive_hash=archive_hash, series_uid=series_uid
+                                ),
+                                file.name, series_uid
+                            )
+                            if decode_error:
+                                csv_data.append({'archive_name': file.name, 'is_valid': False, 'series_uid': decode_error})
+                                continue
                             has_pathology_flag = inference_results.get('study_has_pathology', False)
                             final_prob = inference_results.get('study_prob_pathology', 0.0)
                             ml_time = inference_results.get('study_processing_time', 0.0)
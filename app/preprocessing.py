@@ -0,0 +1,103 @@
+# --- Модуль для предобработки срезов перед моделью ---
+#
+# Флоу:
+# 1. `slice_signature` сжимает подготовленный срез (8-битное изображение)
+#    до маленькой сигнатуры SIGNATURE_SIZE x SIGNATURE_SIZE усреднением по блокам.
+# 2. `group_near_duplicates` проходит срезы по порядку и сравнивает сигнатуру каждого
+#    с сигнатурой последнего представителя: при среднем абсолютном отличии не больше
+#    `tolerance` срез считается дубликатом и получит предсказание представителя.
+# 3. Через модель проходят только представители.
+#
+# Кадрирование и уменьшение (до окна и модели):
+# 1. `body_bbox` строит маску тела порогом по HU на выбранных срезах исследования и находит
+#    рамку грудной клетки: строки и столбцы, где доля тела не меньше `min_fraction`
+#    (самый длинный непрерывный отрезок - так отсекаются стол и шум по краям), плюс отступ.
+# 2. `downscale_max_side` уменьшает подготовленные срезы точно до большей стороны `max_side`
+#    (с сохранением пропорций): усреднение по площади (`Image.BOX` внутри Pillow,
+#    быстрее усреднения через numpy).
+#
+# Мозаика: `tile_mosaic` раскладывает до grid x grid соседних подготовленных срезов
+# в одно изображение (слева направо, сверху вниз; пустые плитки черные).
+
+from typing import List, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+# Сторона сигнатуры среза (пиксели)
+SIGNATURE_SIZE = 16
+
+# Порог тела по HU: воздух вокруг пациента ниже, мягкие ткани и легкие со стенками выше
+BODY_THRESHOLD_HU = -500
+# Минимальная доля тела в строке/столбце, чтобы он вошел в рамку
+BODY_MIN_FRACTION = 0.02
+# Отступ вокруг рамки тела (пиксели)
+BODY_MARGIN = 8
+
+def slice_signature(image: Image.Image, size: int = SIGNATURE_SIZE) -> np.ndarray:
+    """Уменьшенная копия среза (усреднение по блокам) как float32-массив."""
+    return np.asarray(image.convert("L").resize((size, size), Image.BOX), dtype=np.float32)
+
+def group_near_duplicates(images: List[Image.Image], tolerance: float) -> Tuple[List[int], List[int]]:
+    """
+    Разбивает срезы на группы почти одинаковых соседей.
+    Возвращает позиции представителей и для каждого среза номер его представителя.
+    """
+    representatives: List[int] = []
+    owners: List[int] = []
+    last_signature = None
+    for pos, image in enumerate(images):
+        signature = slice_signature(image)
+        if last_signature is None or np.abs(signature - last_signature).mean() > tolerance:
+            representatives.append(pos)
+            last_signature = signature
+        owners.append(len(representatives) - 1)
+    return representatives, owners
+
+def _longest_run(flags: np.ndarray) -> Optional[Tuple[int, int]]:
+    """Самый длинный непрерывный отрезок True: (начало, конец не включительно) или None."""
+    padded = np.concatenate(([False], flags, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    if len(edges) == 0:
+        return None
+    starts, stops = edges[0::2], edges[1::2]
+    longest = int(np.argmax(stops - starts))
+    return int(starts[longest]), int(stops[longest])
+
+def body_bbox(slices: np.ndarray, threshold: float = BODY_THRESHOLD_HU, min_fraction: float = BODY_MIN_FRACTION,
+              margin: int = BODY_MARGIN) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Рамка тела (top, bottom, left, right) по стопке срезов [срезы, высота, ширина] в HU.
+    None, если тело не найдено.
+    """
+    footprint = (np.asarray(slices) > threshold).any(axis=0)
+    rows = _longest_run(footprint.mean(axis=1) >= min_fraction)
+    if rows is None:
+        return None
+    # Столбцы - только в найденных строках: стол под пациентом на них не влияет
+    cols = _longest_run(footprint[rows[0]:rows[1]].mean(axis=0) >= min_fraction)
+    if cols is None:
+        return None
+    height, width = footprint.shape
+    return (max(0, rows[0] - margin), min(height, rows[1] + margin),
+            max(0, cols[0] - margin), min(width, cols[1] + margin))
+
+def downscale_max_side(images: List[Image.Image], max_side: int) -> List[Image.Image]:
+    """Уменьшает срезы усреднением по площади так, чтобы большая сторона была ровно max_side (0 - как есть)."""
+    if max_side <= 0 or not images:
+        return images
+    # Срезы исследования одного размера: один целевой размер на всех. Масштаб - точный,
+    # а не целый шаг: 512 при max_side=448 дает 448, а не 256
+    width, height = images[0].size
+    longest = max(width, height)
+    if longest <= max_side:
+        return images
+    size = (max(1, round(width * max_side / longest)), max(1, round(height * max_side / longest)))
+    return [image.resize(size, Image.BOX) for image in images]
+
+def tile_mosaic(images: List[Image.Image], grid: int) -> Image.Image:
+    """Одно изображение из до grid x grid срезов одного размера: плитки построчно, пустые - черные."""
+    width, height = images[0].size
+    mosaic = Image.new("L", (width * grid, height * grid))
+    for pos, image in enumerate(images[:grid * grid]):
+        mosaic.paste(image.convert("L"), ((pos % grid) * width, (pos // grid) * height))
+    return mosaic
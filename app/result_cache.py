@@ -0,0 +1,145 @@
+# --- Модуль для кэширования результатов инференса на диске ---
+#
+# Флоу:
+# 1. Ключ кэша строится из SHA-256 архива, SeriesInstanceUID серии и
+#    "подписи" классификатора (модель, промпты, параметры выборки) и порога.
+# 2. `ResultCache` хранит результаты в SQLite-файле, общем для API и веб-интерфейса
+#    (путь задается MEDSCREEN_CACHE_PATH), и вытесняет давно не использованные
+#    записи (LRU), когда суммарный размер превышает MEDSCREEN_CACHE_MAX_MB.
+# 3. `get_or_compute` объединяет одновременные одинаковые запросы: модель
+#    запускается один раз, остальные ждут ее результат (single-flight).
+# 4. `run_cached_inference` - обертка над `model.run_inference` с этим кэшем.
+#
+# При попадании в кэш возвращается сохраненный словарь результатов
+# с дополнительным флагом "cache_hit": True.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from app.metrics import CACHE_REQUESTS
+
+# Путь к файлу кэша. Пустая строка отключает кэш.
+CACHE_PATH = os.getenv("MEDSCREEN_CACHE_PATH", os.path.expanduser("~/.cache/medscreen/results.sqlite3"))
+# Максимальный суммарный размер сохраненных результатов (МБ)
+CACHE_MAX_MB = float(os.getenv("MEDSCREEN_CACHE_MAX_MB", "256"))
+
+def make_cache_key(archive_hash: str, series_uid: str, model_signature: dict, threshold: float) -> str:
+    """Строит ключ кэша из хэша архива, UID серии, подписи модели и порога."""
+    payload = json.dumps(
+        {"archive": archive_hash, "series": series_uid, "model": model_signature, "threshold": threshold},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResultCache:
+    """Дисковый LRU-кэш результатов инференса в SQLite с дедупликацией одновременных запросов."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Отдельное соединение на операцию: безопасно для потоков и процессов
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает сохраненный результат или None и обновляет время доступа."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        """Сохраняет результат и вытесняет старые записи сверх лимита размера."""
+        payload = json.dumps(value)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, len(payload), now, now)
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale_keys = []
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM results WHERE key = ?", stale_keys)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Возвращает результат из кэша или вычисляет его.
+        Одновременные запросы с одним ключом ждут единственное вычисление.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            CACHE_REQUESTS.inc(result="hit")
+            return {**cached, "cache_hit": True}
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._inflight[key] = Future()
+        if not is_owner:
+            CACHE_REQUESTS.inc(result="hit")
+            return {**future.result(), "cache_hit": True}
+        CACHE_REQUESTS.inc(result="miss")
+
+        try:
+            value = compute()
+            self.put(key, value)
+            future.set_result(value)
+            return {**value, "cache_hit": False}
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+_cache_instance: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Возвращает общий экземпляр кэша (или None, если кэш отключен)."""
+    global _cache_instance
+    if not CACHE_PATH:
+        return None
+    with _cache_lock:
+        if _cache_instance is None:
+            _cache_instance = ResultCache(CACHE_PATH, int(CACHE_MAX_MB * 1024 * 1024))
+    return _cache_instance
+
+def run_cached_inference(model, volume_3d, archive_hash: Optional[str], series_uid: str, threshold: float = 0.1) -> Dict[str, Any]:
+    """Запускает model.run_inference через дисковый кэш, если известен хэш архива."""
+    cache = get_result_cache()
+    if cache is None or archive_hash is None:
+        return model.run_inference(volume_3d, threshold=threshold)
+    key = make_cache_key(archive_hash, series_uid, model.cache_signature, threshold)
+    return cache.get_or_compute(key, lambda: model.run_inference(volume_3d, threshold=threshold))
@@ -0,0 +1,293 @@
+# --- Модуль оценки исследования по срезам (без зависимости от torch) ---
+#
+# `StudyInference` - общая часть классификаторов: локальной модели (`PathologyClassifier`
+# в `ml_inference.py`) и клиента модельного сервера (`RemoteClassifier` в `model_client.py`).
+# Наследники реализуют только `predict_images` / `_predict_batch` и `model_signature`.
+#
+# Флоу run_inference:
+# 1. Выборка срезов (`quartile_sample_indices`): ленивый объем декодирует только их.
+# 2. Подготовка: (crop_to_body) кадрирование по рамке грудной клетки, найденной один раз
+#    на исследование; легочное окно для всех выбранных срезов одним векторным вызовом;
+#    (max_side > 0) уменьшение до заданной большей стороны.
+# 3. Дедупликация (dedup_tolerance > 0): почти одинаковые соседние срезы не идут в модель,
+#    а получают предсказание представителя (slices_deduplicated; slices_evaluated - только
+#    срезы, реально прошедшие через модель).
+# 4. Оценка срезов моделью. С ранней остановкой (early_exit) - порциями от грубого к точному
+#    (сначала равномерно по объему): оценка прекращается, как только оставшиеся срезы уже
+#    не могут изменить решение, или (при early_exit_margin > 0) когда текущая оценка далеко от порога.
+#    После остановки study_prob_pathology считается только по оцененным срезам (early_exited=True)
+#    и не сравнима с вероятностью полного прохода; решение при точном правиле то же.
+# 5. Агрегация по исследованию (aggregation): "vote" - доля срезов с патологией,
+#    "mean" - средняя вероятность по срезам.
+
+import os
+import time
+import numpy as np
+from PIL import Image
+from typing import Dict, List, Any, Optional, Tuple
+
+from app.metrics import stage_timer, STAGE_SECONDS, SLICES_PER_STUDY
+from app.preprocessing import group_near_duplicates, body_bbox, downscale_max_side
+from app.windowing import window_to_uint8
+
+# Размер батча для модели (и размер порции при ранней остановке)
+BATCH_SIZE = int(os.getenv("MEDSCREEN_BATCH_SIZE", "4"))
+# "vote" - доля срезов с патологией, "mean" - средняя вероятность по срезам
+AGGREGATION = os.getenv("MEDSCREEN_AGGREGATION", "vote")
+
+# --- Параметры ранней остановки ---
+# Оценивать срезы порциями и останавливаться, когда решение уже не изменится
+EARLY_EXIT = os.getenv("MEDSCREEN_EARLY_EXIT", "0") == "1"
+# Остановка по уверенности: |текущая оценка - порог| >= margin (0 - только точное правило)
+EARLY_EXIT_MARGIN = float(os.getenv("MEDSCREEN_EARLY_EXIT_MARGIN", "0"))
+# Минимум оцененных срезов перед остановкой по уверенности
+EARLY_EXIT_MIN_SLICES = int(os.getenv("MEDSCREEN_EARLY_EXIT_MIN_SLICES", "16"))
+
+# --- Параметры дедупликации ---
+# Допустимое среднее отличие сигнатур соседних срезов (0-255) для повторного использования
+# предсказания; 0 - дедупликация выключена
+DEDUP_TOLERANCE = float(os.getenv("MEDSCREEN_DEDUP_TOLERANCE", "0"))
+
+# --- Параметры подготовки срезов ---
+# Кадрировать срезы по рамке тела (грудной клетки): воздух и стол не идут в модель
+CROP_TO_BODY = os.getenv("MEDSCREEN_CROP_TO_BODY", "0") == "1"
+# Наибольшая сторона среза перед моделью (пиксели); 0 - без уменьшения
+MAX_SIDE = int(os.getenv("MEDSCREEN_MAX_SIDE", "0"))
+
+# Легочное окно (center, width), как в скрипте коллеги
+LUNG_WINDOW = (-600, 1500)
+
+# --- Вспомогательные функции для выборки срезов ---
+def select_step(n_slices: int) -> int:
+    if n_slices < 50:   return 1
+    if n_slices < 100:  return 2
+    if n_slices < 200:  return 4
+    if n_slices < 400:  return 6
+    if n_slices < 600:  return 8
+    return 10
+
+def quartile_sample_indices(n_files: int, n: int) -> list[int]:
+    if n == 0: n = 1
+    q1, q2, q3 = n_files // 4, n_files // 2, (3 * n_files) // 4
+    idx = set()
+    idx.update(range(0, q1, n))
+    idx.update(range(q1, q2, max(1, n//2)))
+    idx.update(range(q2, q3, max(1, n//2)))
+    idx.update(range(q3, n_files, n))
+    if n_files > 0:
+        idx.add(n_files - 1)
+    return sorted(list(idx))
+
+def coarse_to_fine_order(count: int) -> list[int]:
+    """Порядок обхода позиций 0..count-1: сначала редкая равномерная сетка, затем ее сгущение."""
+    order, seen = [], set()
+    stride = 1
+    while stride < count:
+        stride *= 2
+    while stride >= 1:
+        for pos in range(0, count, stride):
+            if pos not in seen:
+                seen.add(pos)
+                order.append(pos)
+        stride //= 2
+    return order
+
+class StudyInference:
+    """Выборка, подготовка и агрегация срезов исследования; сама оценка среза - в наследниках."""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, aggregation: str = AGGREGATION,
+                 early_exit: bool = EARLY_EXIT, early_exit_margin: float = EARLY_EXIT_MARGIN,
+                 early_exit_min_slices: int = EARLY_EXIT_MIN_SLICES, dedup_tolerance: float = DEDUP_TOLERANCE,
+                 crop_to_body: bool = CROP_TO_BODY, max_side: int = MAX_SIDE):
+        if aggregation not in ("vote", "mean"):
+            raise ValueError(f"Неизвестный способ агрегации: {aggregation}")
+        self.batch_size = batch_size
+        self.aggregation = aggregation
+        self.early_exit = early_exit
+        self.early_exit_margin = early_exit_margin
+        self.early_exit_min_slices = early_exit_min_slices
+        self.dedup_tolerance = dedup_tolerance
+        self.crop_to_body = crop_to_body
+        self.max_side = max_side
+        # Общий планировщик микро-батчей (задает наследник)
+        self.scheduler = None
+        # Сколько раз батч повторялся с меньшим размером из-за нехватки памяти (за все время)
+        self.oom_retries = 0
+
+    @property
+    def model_signature(self) -> Dict[str, Any]:
+        """Все, что влияет на оценку одного среза (модель, промпты, режим)."""
+        raise NotImplementedError
+
+    @property
+    def model_batch_size(self) -> int:
+        """Текущий размер батча модели."""
+        return self.batch_size
+
+    @property
+    def cache_signature(self) -> Dict[str, Any]:
+        """Все, что влияет на результат инференса (кроме данных): ключ для кэша результатов."""
+        return {
+            **self.model_signature,
+            "sampling": "quartile",
+            "aggregation": self.aggregation,
+            "early_exit": self.early_exit,
+            "early_exit_margin": self.early_exit_margin if self.early_exit else None,
+            "early_exit_min_slices": self.early_exit_min_slices if self.early_exit else None,
+            "dedup_tolerance": self.dedup_tolerance,
+            "crop_to_body": self.crop_to_body,
+            "max_side": self.max_side,
+        }
+
+    def _study_bbox(self, slices: np.ndarray) -> Optional[tuple]:
+        """Рамка тела для кадрирования всех срезов исследования (None - без кадрирования)."""
+        if not self.crop_to_body:
+            return None
+        with stage_timer("body_bbox"):
+            return body_bbox(slices)
+
+    @stage_timer("prepare_slices")
+    def _prepare_slices(self, slices: np.ndarray, bbox: Optional[tuple] = None) -> List[Image.Image]:
+        """
+        Кадрирует срезы по рамке тела, применяет легочное окно одним векторным вызовом,
+        конвертирует в PIL Image и уменьшает до max_side.
+        """
+        if bbox is not None:
+            top, bottom, left, right = bbox
+            slices = slices[:, top:bottom, left:right]
+        # float64 - как в прежней формуле подготовки срезов: входы модели не меняются
+        uint8_slices = window_to_uint8(slices, *LUNG_WINDOW, precision=np.float64)
+        return downscale_max_side([Image.fromarray(img_array) for img_array in uint8_slices], self.max_side)
+
+    def _predict_batch(self, images: List[Image.Image]) -> List[float]:
+        """Прогоняет подготовленные срезы через модель и возвращает вероятности патологии."""
+        raise NotImplementedError
+
+    def predict_images(self, images: List[Image.Image]) -> List[float]:
+        """Вероятности патологии для подготовленных срезов: напрямую или через общий планировщик."""
+        if self.scheduler is not None:
+            return self.scheduler.submit(images)
+        return self._predict_batch(images)
+
+    def run_inference(self, volume_3d: np.ndarray, threshold: float = 0.1) -> Dict[str, Any]:
+        start_time = time.time()
+        oom_retries_before = self.oom_retries
+
+        # 1. Выборка срезов
+        num_total_slices = volume_3d.shape[0]
+        step = select_step(num_total_slices)
+        indices_to_process = quartile_sample_indices(num_total_slices, step)
+
+        if not indices_to_process:
+            return {
+                'study_has_pathology': False, 'study_prob_pathology': 0.0,
+                'study_processing_time': 0.0, 'pred_slices': [], 'prob_slices': [],
+                'slices_sampled': 0, 'slices_evaluated': 0, 'slices_deduplicated': 0, 'early_exited': False,
+                'batch_size': self.model_batch_size, 'oom_retries': 0
+            }
+
+        # 2-4. Инференс: все выбранные срезы сразу или порциями с ранней остановкой
+        if self.early_exit:
+            probs_by_index, slices_evaluated = self._predict_adaptive(volume_3d, indices_to_process, threshold)
+        else:
+            # Берем только выбранные срезы: ленивый объем декодирует лишь их
+            slices = volume_3d[indices_to_process]
+            probs, slices_evaluated = self._predict_slices(slices, self._study_bbox(slices))
+            probs_by_index = dict(zip(indices_to_process, probs))
+        # Срезы с предсказанием, взятым у почти одинакового соседа
+        slices_deduplicated = len(probs_by_index) - slices_evaluated
+
+        # 5. Агрегация и возврат результата в старом формате
+        slice_probs = list(probs_by_index.values())
+        study_prob_pathology = self._aggregate(slice_probs)
+        study_has_pathology = study_prob_pathology >= threshold
+
+        # Создаем полный список предсказаний для всех срезов (False / None по умолчанию)
+        full_preds = [False] * num_total_slices
+        full_probs: List[Optional[float]] = [None] * num_total_slices
+        for pred_idx, prob in probs_by_index.items():
+            full_preds[pred_idx] = prob >= 0.5
+            full_probs[pred_idx] = prob
+
+        processing_time = time.time() - start_time
+        STAGE_SECONDS.observe(processing_time, stage="inference")
+        SLICES_PER_STUDY.observe(num_total_slices, kind="total")
+        SLICES_PER_STUDY.observe(len(indices_to_process), kind="sampled")
+        SLICES_PER_STUDY.observe(slices_evaluated, kind="evaluated")
+        SLICES_PER_STUDY.observe(slices_deduplicated, kind="deduplicated")
+
+        return {
+            "study_has_pathology": study_has_pathology,
+            "study_prob_pathology": study_prob_pathology,
+            "study_processing_time": processing_time,
+            "pred_slices": full_preds,
+            "prob_slices": full_probs,
+            "slices_sampled": len(indices_to_process),
+            "slices_evaluated": slices_evaluated,
+            "slices_deduplicated": slices_deduplicated,
+            # Остановились раньше: вероятность исследования - только по оцененным срезам
+            "early_exited": len(probs_by_index) < len(indices_to_process),
+            # При одновременных исследованиях сюда попадают и повторы общих батчей
+            "batch_size": self.model_batch_size,
+            "oom_retries": self.oom_retries - oom_retries_before
+        }
+
+    def _predict_slices(self, slices, bbox: Optional[tuple] = None) -> Tuple[List[float], int]:
+        """
+        Подготовка срезов, дедупликация и вероятности патологии для каждого среза;
+        второе значение - сколько срезов реально прошло через модель.
+        """
+        images = self._prepare_slices(slices, bbox)
+        owners = None
+        if self.dedup_tolerance > 0:
+            # В модель идут только представители групп почти одинаковых срезов
+            representatives, owners = group_near_duplicates(images, self.dedup_tolerance)
+            images = [images[pos] for pos in representatives]
+
+        probs = self.predict_images(images)
+        return (probs if owners is None else [probs[owner] for owner in owners]), len(images)
+
+    def _predict_adaptive(self, volume_3d, indices: List[int], threshold: float) -> Tuple[Dict[int, float], int]:
+        """
+        Оценивает срезы порциями от грубого к точному, пока оставшиеся могут изменить решение.
+        Возвращает вероятности по индексам срезов и число срезов, прошедших через модель.
+        """
+        total = len(indices)
+        probs_by_index: Dict[int, float] = {}
+        model_evaluated = 0
+        score_sum = 0.0
+        order = [indices[pos] for pos in coarse_to_fine_order(total)]
+        bbox = None
+
+        for start in range(0, total, self.batch_size):
+            chunk = sorted(order[start:start + self.batch_size])
+            slices = volume_3d[chunk]
+            if start == 0:
+                # Рамка тела - по первой порции: она равномерно покрывает объем
+                bbox = self._study_bbox(slices)
+            probs, chunk_evaluated = self._predict_slices(slices, bbox)
+            model_evaluated += chunk_evaluated
+            for idx, prob in zip(chunk, probs):
+                probs_by_index[idx] = prob
+                # Вклад среза в оценку исследования: голос (0/1) или вероятность
+                score_sum += float(prob >= 0.5) if self.aggregation == "vote" else prob
+
+            evaluated = len(probs_by_index)
+            # Точное правило: итог по всей выборке лежит в [score_sum, score_sum + осталось] / total
+            if score_sum / total >= threshold or (score_sum + total - evaluated) / total < threshold:
+                break
+            # Правило уверенности: текущая оценка достаточно далеко от порога
+            if (self.early_exit_margin > 0 and evaluated >= self.early_exit_min_slices
+                    and abs(score_sum / evaluated - threshold) >= self.early_exit_margin):
+                break
+
+        return dict(sorted(probs_by_index.items())), model_evaluated
+
+    def _aggregate(self, slice_probs: List[float]) -> float:
+        """Вероятность патологии для исследования по вероятностям срезов."""
+        if not slice_probs:
+            return 0.0
+        if self.aggregation == "mean":
+            return float(np.mean(slice_probs))
+        # "vote": доля срезов, признанных патологическими
+        return sum(prob >= 0.5 for prob in slice_probs) / len(slice_probs)
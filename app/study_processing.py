@@ -0,0 +1,110 @@
+# --- Модуль для обработки одного архива "от и до" ---
+#
+# Флоу:
+# 1. `process_archive` парсит ZIP-архив (`parse_zip_archive`).
+# 2. Для каждой найденной серии проводит валидацию (`validate_series`).
+# 3. Для валидных серий запускает инференс через дисковый кэш результатов.
+# 4. Возвращает список строк отчета - тот же формат, что отдает API `/process`.
+#
+# `series_rows` (шаги 2-4 для уже разобранного исследования) используется и пакетным
+# запуском `python -m app.batch`, который парсит исследования в отдельном пуле потоков.
+# `process_study_path` - то же для исследования на диске (ZIP, папка или NIfTI), читаемого на месте.
+
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.file_io import DicomDecodeError, parse_zip_archive, compute_archive_hash, parse_study_path, compute_study_hash
+from app.data_validation import validate_series
+from app.result_cache import run_cached_inference
+from app.metrics import stage_timer
+
+def error_row(archive_name: str, error_message: str) -> Dict[str, Any]:
+    """Строка отчета для архива, который не удалось разобрать."""
+    return {
+        'archive_name': archive_name, 'series_uid': error_message or "Parsing error",
+        'is_valid': False, 'has_pathology': False, 'pred_pathology': "0.0000",
+        'ml_processing_time': "0.00s", 'source_format': 'N/A', 'modality': 'N/A',
+        'body_part': 'N/A', 'orientation': 'N/A', 'num_frames': 0, 'slices_evaluated': 0,
+        'slices_deduplicated': 0, 'early_exited': False
+    }
+
+def run_series_inference(run: Callable[[], Dict[str, Any]], archive_name: str,
+                         series_uid: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Инференс серии run(): (результаты, None) или (None, сообщение), если срез DICOM не декодируется.
+    Срезы декодируются лениво, поэтому битый срез проявляется только здесь. Остальные ошибки
+    (модель, память, модельный сервер) пробрасываются: это сбой обработки, а не свойство серии.
+    """
+    try:
+        return run(), None
+    except DicomDecodeError as e:
+        logging.getLogger('model_logger').error(f"{archive_name}/{series_uid}: {e}")
+        return None, f"Ошибка декодирования серии: {e}"
+
+def is_error_row(row: Dict[str, Any]) -> bool:
+    """Строка error_row: архив или серию не удалось разобрать или декодировать."""
+    return not row['is_valid'] and row['source_format'] == 'N/A'
+
+@stage_timer("process_archive")
+def process_archive(model, file_input, archive_name: str, threshold: float = 0.1) -> List[Dict[str, Any]]:
+    """Обрабатывает один ZIP-архив и возвращает строки отчета по каждой серии."""
+    series_data, error_message = parse_zip_archive(file_input, archive_name=archive_name)
+    if not series_data or error_message:
+        return [error_row(archive_name, error_message)]
+
+    return series_rows(model, series_data, compute_archive_hash(file_input), archive_name, threshold)
+
+@stage_timer("process_archive")
+def process_study_path(model, path: str, archive_name: str, threshold: float = 0.1) -> List[Dict[str, Any]]:
+    """Обрабатывает исследование на диске (ZIP, папка или NIfTI) без копирования и возвращает строки отчета."""
+    series_data, error_message = parse_study_path(path)
+    if not series_data or error_message:
+        return [error_row(archive_name, error_message)]
+
+    return series_rows(model, series_data, compute_study_hash(path), archive_name, threshold)
+
+def series_rows(model, series_data: Dict[str, Any], archive_hash: str, archive_name: str,
+                threshold: float = 0.1) -> List[Dict[str, Any]]:
+    """Валидация и инференс для разобранных серий: строки отчета по каждой серии."""
+    rows = []
+    for series_uid, data in series_data.items():
+        meta = data['meta']
+        validation_checks = validate_series(meta)
+        is_valid = all(check['status'] for check in validation_checks)
+
+        if is_valid and len(data['frames']) > 0:
+            inference_results, decode_error = run_series_inference(
+                lambda: run_cached_inference(model, data['frames'], archive_hash, series_uid, threshold=threshold),
+                archive_name, series_uid
+            )
+            if decode_error:
+                rows.append(error_row(archive_name, decode_error))
+                continue
+            has_pathology_flag = inference_results.get('study_has_pathology', False)
+            final_prob = inference_results.get('study_prob_pathology', 0.0)
+            ml_time = inference_results.get('study_processing_time', 0.0)
+            slices_evaluated = inference_results.get('slices_evaluated', 0)
+            slices_deduplicated = inference_results.get('slices_deduplicated', 0)
+            early_exited = inference_results.get('early_exited', False)
+        else:
+            has_pathology_flag, final_prob, ml_time, early_exited = False, 0.0, 0.0, False
+            slices_evaluated = slices_deduplicated = 0
+
+        rows.append({
+            'archive_name': archive_name,
+            'series_uid': series_uid,
+            'source_format': meta.get('SourceFormat', 'N/A'),
+            'modality': meta.get('Modality', 'N/A'),
+            'body_part': meta.get('BodyPartExamined', 'N/A'),
+            'orientation': meta.get('orientation', 'N/A'),
+            'num_frames': meta.get('num_frames', 0),
+            'is_valid': is_valid,
+            'has_pathology': has_pathology_flag,
+            'pred_pathology': f"{final_prob:.4f}",
+            'ml_processing_time': f"{ml_time:.2f}s",
+            'slices_evaluated': slices_evaluated,
+            'slices_deduplicated': slices_deduplicated,
+            # pred_pathology посчитана только по оцененным срезам
+            'early_exited': early_exited
+        })
+    return rows
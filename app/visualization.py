@@ -2,52 +2,156 @@
 #
 # Флоу:
 # 1. Функции получают "сырые" 3D-данные (numpy array).
-# 2. Применяют необходимые преобразования:
-#    - `apply_ct_window` для КТ-окон.
-#    - `normalize_to_uint8` для приведения к 8-битному формату (0-255).
-# 3. `create_gif` создает анимацию из готовых 8-битных кадров.
+# 2. Переводят их в 8-битный формат (0-255) через общий модуль `windowing`:
+#    - КТ-окно для КТ (`window_to_uint8`, таблица для целочисленных HU).
+#    - нормализация по диапазону значений для остальных данных (`minmax_to_uint8`).
+# 3. `create_gif` создает анимацию из готовых 8-битных кадров в пределах бюджета:
+#    не больше ANIMATION_MAX_FRAMES кадров (равномерно по серии) и не больше
+#    ANIMATION_MAX_PIXELS пикселей на кадр (целочисленное уменьшение).
+#    GIF пишется с фиксированной серой палитрой (кадры 'L' без квантования);
+#    вместо GIF можно получить анимированный WebP или MP4 (нужен imageio-ffmpeg).
+#
+# Превью по требованию:
+# - `render_slice` готовит один кадр (ленивый объем декодирует только его),
+#   `SliceRenderCache` хранит последние кадры сессии (LRU по (серия, окно, срез)).
+# - `submit_preview_animation` собирает анимацию в фоновом потоке из прореженного
+#   набора кадров (декодируются только они) и возвращает Future.
 
 import io
+import logging
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Hashable, Tuple
 import numpy as np
-import imageio
+import imageio.v3 as iio
 import streamlit as st
+from PIL import Image
 
-def apply_ct_window(volume: np.ndarray, center: int, width: int) -> np.ndarray:
-    """Применяет оконное преобразование (windowing) к КТ-объему."""
-    lo, hi = center - width / 2, center + width / 2
-    volume = np.clip(volume, lo, hi)
-    volume = (volume - lo) / (hi - lo + 1e-6)
-    return volume
+from app.windowing import window_to_uint8, minmax_to_uint8
 
-def normalize_to_uint8(volume: np.ndarray) -> np.ndarray:
-    """Конвертирует нормализованный массив (0-1) в 8-битное изображение (0-255)."""
-    volume = np.clip(volume, 0, 1)
-    return (volume * 255).astype(np.uint8)
+# Сколько отрисованных срезов хранить в LRU-кэше сессии
+PREVIEW_CACHE_SLICES = int(os.getenv("MEDSCREEN_PREVIEW_CACHE_SLICES", "64"))
+# Бюджет анимации: кадров и пикселей на кадр
+ANIMATION_MAX_FRAMES = int(os.getenv("MEDSCREEN_ANIMATION_MAX_FRAMES", "64"))
+ANIMATION_MAX_PIXELS = int(os.getenv("MEDSCREEN_ANIMATION_MAX_PIXELS", str(256 * 256)))
+# Формат анимации превью: "gif", "webp" или "mp4"
+ANIMATION_FORMAT = os.getenv("MEDSCREEN_ANIMATION_FORMAT", "gif")
+ANIMATION_MIME_TYPES = {"gif": "image/gif", "webp": "image/webp", "mp4": "video/mp4"}
+# Сколько срезов читается для оценки диапазона значений не-КТ ленивого объема
+_RANGE_SAMPLE_SLICES = 32
+
+# Сборка анимаций превью в фоне: страница не ждет кодирования
+_animation_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="medscreen-preview-animation")
+
+def _fit_to_budget(frames: list, max_frames: int, max_pixels: int) -> list:
+    """Прореживает кадры и уменьшает их в целое число раз, чтобы уложиться в бюджет."""
+    frames = [frames[i] for i in decimate_indices(len(frames), max_frames)]
+    if not frames:
+        return []
+    height, width = frames[0].shape[:2]
+    factor = max(1, math.ceil(math.sqrt(height * width / max_pixels)))
+    images = [Image.fromarray(np.asarray(frame, dtype=np.uint8)) for frame in frames]
+    return [image.reduce(factor) for image in images] if factor > 1 else images
+
+def encode_animation(frames: list, duration_ms: int = 50, fmt: str = "gif",
+                     max_frames: int = ANIMATION_MAX_FRAMES, max_pixels: int = ANIMATION_MAX_PIXELS) -> bytes:
+    """Кодирует 8-битные кадры в анимацию (GIF, WebP или MP4) в пределах бюджета кадров и пикселей."""
+    if fmt not in ANIMATION_MIME_TYPES:
+        raise ValueError(f"Неизвестный формат анимации: {fmt}")
+    images = _fit_to_budget(frames, max_frames, max_pixels)
+    if not images:
+        return b""
+
+    if fmt == "mp4":
+        # H.264 требует четных сторон кадра
+        height, width = images[0].height // 2 * 2, images[0].width // 2 * 2
+        stack = np.stack([np.asarray(image)[:height, :width] for image in images])
+        return iio.imwrite("<bytes>", stack, extension=".mp4", plugin="FFMPEG", fps=1000 / duration_ms)
 
-@st.cache_data(show_spinner="Создание анимации...")
-def create_gif(frames: list, duration_ms: int = 50) -> bytes:
-    """Создает GIF-анимацию из списка 8-битных кадров."""
     with io.BytesIO() as buffer:
-        imageio.mimsave(buffer, frames, format='GIF', duration=duration_ms, loop=0)
+        options = {"lossless": False, "quality": 80, "method": 0} if fmt == "webp" else {"optimize": False}
+        # Кадры в режиме 'L': GIF получает фиксированную серую палитру без квантования
+        images[0].save(buffer, format=fmt.upper(), save_all=True, append_images=images[1:],
+                       duration=duration_ms, loop=0, **options)
         return buffer.getvalue()
 
+@st.cache_data(show_spinner="Создание анимации...")
+def create_gif(frames: list, duration_ms: int = 50, fmt: str = "gif") -> bytes:
+    """Создает анимацию (по умолчанию GIF) из списка 8-битных кадров."""
+    return encode_animation(frames, duration_ms, fmt)
+
+def display_window(_series_data: dict, window_name: str, ct_windows: dict) -> Tuple[float, float]:
+    """Окно (center, width) для отображения: КТ-окно или диапазон значений серии."""
+    if _series_data["meta"].get("Modality") == "CT":
+        return ct_windows[window_name]
+    frames = _series_data["frames"]
+    if not isinstance(frames, np.ndarray):
+        # Ленивый объем целиком не декодируем: диапазон оцениваем по равномерной выборке срезов
+        frames = frames[decimate_indices(len(frames), _RANGE_SAMPLE_SLICES)]
+    lo, hi = float(frames.min()), float(frames.max())
+    return (lo + hi) / 2, hi - lo
+
+def decimate_indices(num_frames: int, max_frames: int) -> np.ndarray:
+    """Не больше max_frames индексов, равномерно по всей серии (первый и последний включены)."""
+    if num_frames <= max_frames:
+        return np.arange(num_frames)
+    return np.unique(np.linspace(0, num_frames - 1, max_frames).round().astype(int))
+
+def render_slice(frames, idx: int, window: Tuple[float, float]) -> np.ndarray:
+    """Один кадр серии в uint8 для отображения."""
+    return window_to_uint8(frames[idx], *window)
+
+class SliceRenderCache:
+    """LRU-кэш отрисованных кадров превью (ключ - серия, окно и номер среза)."""
+
+    def __init__(self, max_items: int = PREVIEW_CACHE_SLICES):
+        self.max_items = max_items
+        self._frames: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+
+    def get_or_render(self, key: Hashable, render: Callable[[], np.ndarray]) -> np.ndarray:
+        if key in self._frames:
+            self._frames.move_to_end(key)
+            return self._frames[key]
+        frame = render()
+        self._frames[key] = frame
+        while len(self._frames) > self.max_items:
+            self._frames.popitem(last=False)
+        return frame
+
+def _build_preview_animation(frames, window: Tuple[float, float], fmt: str) -> Tuple[bytes, str]:
+    # Декодируем и переводим в uint8 только кадры, которые войдут в анимацию
+    indices = decimate_indices(len(frames), ANIMATION_MAX_FRAMES)
+    uint8_frames = list(window_to_uint8(frames[indices], *window))
+    try:
+        return encode_animation(uint8_frames, fmt=fmt), ANIMATION_MIME_TYPES[fmt]
+    except Exception as e:
+        if fmt == "gif":
+            raise
+        logging.warning(f"Не удалось закодировать анимацию в {fmt} ({e}), используется GIF")
+        return encode_animation(uint8_frames, fmt="gif"), ANIMATION_MIME_TYPES["gif"]
+
+def submit_preview_animation(frames, window: Tuple[float, float], fmt: str = ANIMATION_FORMAT) -> Future:
+    """Запускает фоновую сборку анимации превью; результат - (байты, MIME-тип)."""
+    return _animation_executor.submit(_build_preview_animation, frames, window, fmt)
+
 @st.cache_data(show_spinner="Подготовка кадров для просмотра...")
-def prepare_frames_for_display(_series_data: dict, window_name: str, ct_windows: dict) -> list:
+def prepare_frames_for_display(_series_data: dict, fingerprint: str, window_name: str, ct_windows: dict) -> list:
     """
     Готовит все кадры серии к отображению: применяет окно и конвертирует в uint8.
-    Функция обернута в st.cache_data для кэширования результата.
+    Функция обернута в st.cache_data: ключ - отпечаток серии и окно.
     """
-    raw_frames = _series_data["frames"]
+    # Для отображения нужны все кадры: ленивый объем декодируется целиком
+    raw_frames = np.asarray(_series_data["frames"])
     meta = _series_data["meta"]
     
     if meta.get("Modality") == "CT":
         center, width = ct_windows[window_name]
-        processed_frames = apply_ct_window(raw_frames, center, width)
+        uint8_frames = window_to_uint8(raw_frames, center, width)
     else:
         # Для не-КТ данных просто нормализуем по всему диапазону
-        lo, hi = raw_frames.min(), raw_frames.max()
-        processed_frames = (raw_frames - lo) / (hi - lo + 1e-6)
-        
-    uint8_frames = normalize_to_uint8(processed_frames)
+        uint8_frames = minmax_to_uint8(raw_frames)
+
     # Возвращаем как список отдельных кадров
     return [frame for frame in uint8_frames]
\ No newline at end of file
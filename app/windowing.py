@@ -0,0 +1,64 @@
+# --- Модуль оконного преобразования (windowing) в 8 бит ---
+#
+# Общий для отображения (`visualization.py`) и модели (`ml_inference.py`).
+#
+# Флоу:
+# 1. `window_lut(center, width, dtype, precision)` один раз строит таблицу "значение -> uint8"
+#    для всех значений целочисленного типа (int16/uint16 - 65536, int8/uint8 - 256)
+#    и кэширует ее для пары (center, width).
+# 2. `window_to_uint8` переводит весь объем (или выбранные срезы) в uint8 одним
+#    векторным `np.take` по таблице - без промежуточных float-массивов.
+# 3. Для float-данных (нецелый rescale) - один float32-буфер и операции на месте.
+#
+# Формула та же, что раньше считалась отдельно в визуализации и при подготовке срезов для модели,
+# и в той же точности (таблица побитово совпадает с прежним результатом):
+#   uint8(clip((clip(v, lo, hi) - lo) / (hi - lo + 1e-6), 0, 1) * 255), lo/hi = center -/+ width / 2
+# Визуализация считала ее во float32 (precision по умолчанию), подготовка срезов для модели -
+# во float64 (целые HU numpy приводил к float64): модель передает precision=np.float64.
+
+from functools import lru_cache
+import numpy as np
+
+# Типы, для которых значение целиком помещается в индекс таблицы
+_LUT_DTYPES = {
+    np.dtype(np.int16): np.uint16, np.dtype(np.uint16): np.uint16,
+    np.dtype(np.int8): np.uint8, np.dtype(np.uint8): np.uint8,
+}
+
+def _scale_to_uint8(buffer: np.ndarray, lo: float, hi: float) -> np.ndarray:
+    """Окно на месте во float-буфере (в его точности, по шагам прежней формулы) и перевод в uint8."""
+    np.clip(buffer, lo, hi, out=buffer)
+    buffer -= lo
+    buffer /= hi - lo + 1e-6
+    np.clip(buffer, 0, 1, out=buffer)
+    buffer *= 255
+    return buffer.astype(np.uint8)
+
+@lru_cache(maxsize=32)
+def window_lut(center: float, width: float, dtype: np.dtype, precision: np.dtype = np.dtype(np.float32)) -> np.ndarray:
+    """Таблица uint8 для всех значений dtype, индексируемая их битовым представлением."""
+    index_dtype = _LUT_DTYPES[np.dtype(dtype)]
+    values = np.arange(np.iinfo(index_dtype).max + 1, dtype=np.int64).astype(index_dtype).view(dtype)
+    lut = _scale_to_uint8(values.astype(precision), center - width / 2, center + width / 2)
+    lut.flags.writeable = False
+    return lut
+
+def window_to_uint8(volume: np.ndarray, center: float, width: float, precision=np.float32) -> np.ndarray:
+    """
+    Применяет окно (center, width) ко всему массиву и возвращает uint8 той же формы.
+    precision - точность формулы для целочисленных данных (float32 или float64).
+    """
+    volume = np.asarray(volume)
+    index_dtype = _LUT_DTYPES.get(volume.dtype)
+    if index_dtype is not None:
+        lut = window_lut(float(center), float(width), volume.dtype, np.dtype(precision))
+        return np.take(lut, volume.view(index_dtype))
+
+    # Один float32-буфер и операции на месте
+    return _scale_to_uint8(volume.astype(np.float32), center - width / 2, center + width / 2)
+
+def minmax_to_uint8(volume: np.ndarray) -> np.ndarray:
+    """Нормализация по всему диапазону значений (для не-КТ данных) в uint8."""
+    volume = np.asarray(volume)
+    lo, hi = float(volume.min()), float(volume.max())
+    return window_to_uint8(volume, (lo + hi) / 2, hi - lo)
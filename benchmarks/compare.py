@@ -0,0 +1,33 @@
+# --- Сравнение двух прогонов бенчмарков ---
+#
+# Запуск: python -m benchmarks.compare baseline.json candidate.json
+# Для каждого общего замера печатает медианное время и пиковую память
+# в обоих прогонах и их отношение (< 1.00 - кандидат быстрее / экономнее).
+
+import argparse
+import json
+import sys
+
+def _load(path: str) -> dict:
+    with open(path) as f:
+        report = json.load(f)
+    return {(r["benchmark"], r["format"], r["num_slices"]): r for r in report["results"]}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Сравнение двух JSON-файлов с результатами бенчмарков.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args(argv)
+
+    baseline, candidate = _load(args.baseline), _load(args.candidate)
+    print(f"{'benchmark':>16} {'format':>16} {'slices':>6} | {'time, ms':>21} {'ratio':>6} | {'peak, MB':>19} {'ratio':>6}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[key], candidate[key]
+        old_time, new_time = old["time_s"]["median"] * 1000, new["time_s"]["median"] * 1000
+        old_peak, new_peak = old["peak_mb"], new["peak_mb"]
+        print(f"{key[0]:>16} {key[1]:>16} {key[2]:>6} | {old_time:10.1f} {new_time:10.1f} {new_time / max(old_time, 1e-9):6.2f} | "
+              f"{old_peak:9.1f} {new_peak:9.1f} {new_peak / max(old_peak, 1e-9):6.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
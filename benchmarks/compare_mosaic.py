@@ -0,0 +1,76 @@
+# --- Сравнение мозаики с оценкой по срезам на реальной модели ---
+#
+# Запуск (нужны веса модели): python -m benchmarks.compare_mosaic study1.zip study2.zip --grid 2
+#
+# Флоу:
+# 1. Загружает PathologyClassifier в режиме "generate" один раз.
+# 2. Для каждой серии каждого архива запускает run_inference по срезам (mosaic_grid=1)
+#    и с мозаикой (mosaic_grid=--grid), считая промпты, отправленные в модель.
+# 3. Печатает время, число промптов, совпадение решения по исследованию и доли
+#    совпавших меток срезов; с --output пишет те же строки в JSON.
+
+import argparse
+import json
+import sys
+import time
+
+from app.file_io import parse_zip_archive
+from app.ml_inference import PathologyClassifier
+
+def _run(classifier: PathologyClassifier, grid: int, frames, threshold: float) -> dict:
+    """run_inference с заданной стороной мозаики: результат, время и число промптов."""
+    classifier.mosaic_grid = grid
+    prompts = 0
+    generate_chunk = PathologyClassifier._generate_chunk
+
+    def counting_chunk(chunk):
+        nonlocal prompts
+        prompts += len(chunk)
+        return generate_chunk(classifier, chunk)
+
+    classifier._generate_chunk = counting_chunk
+    try:
+        start_time = time.perf_counter()
+        result = classifier.run_inference(frames, threshold)
+        return {"result": result, "time_s": time.perf_counter() - start_time, "prompts": prompts}
+    finally:
+        del classifier._generate_chunk
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Сравнение мозаики с оценкой по срезам: согласие и время.")
+    parser.add_argument("archives", nargs="+", help="ZIP-архивы с исследованиями")
+    parser.add_argument("--grid", type=int, default=2, help="Сторона мозаики (2 - 2x2)")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Порог решения по исследованию")
+    parser.add_argument("--output", help="Файл для результатов (JSON)")
+    args = parser.parse_args(argv)
+
+    classifier = PathologyClassifier(scoring_mode="generate", micro_batching=False, early_exit=False)
+    rows = []
+    print(f"{'series':>24} | {'time, s':>15} | {'prompts':>11} | {'study':>5} {'slices':>6}")
+    for path in args.archives:
+        data, error_message = parse_zip_archive(path)
+        if error_message:
+            print(f"{path}: {error_message}", file=sys.stderr)
+            continue
+        for series_uid, series in data.items():
+            single = _run(classifier, 1, series["frames"], args.threshold)
+            mosaic = _run(classifier, args.grid, series["frames"], args.threshold)
+            pairs = [(a, b) for a, b in zip(single["result"]["prob_slices"], mosaic["result"]["prob_slices"]) if a is not None]
+            slice_agreement = sum((a >= 0.5) == (b >= 0.5) for a, b in pairs) / max(len(pairs), 1)
+            study_agreement = single["result"]["study_has_pathology"] == mosaic["result"]["study_has_pathology"]
+            rows.append({
+                "archive": path, "series_uid": series_uid, "grid": args.grid,
+                "time_s": {"single": single["time_s"], "mosaic": mosaic["time_s"]},
+                "prompts": {"single": single["prompts"], "mosaic": mosaic["prompts"]},
+                "study_agreement": study_agreement, "slice_agreement": slice_agreement,
+            })
+            print(f"{series_uid[-24:]:>24} | {single['time_s']:7.1f} {mosaic['time_s']:7.1f} | "
+                  f"{single['prompts']:5d} {mosaic['prompts']:5d} | {'yes' if study_agreement else 'no':>5} {slice_agreement:6.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
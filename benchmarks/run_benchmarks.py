@@ -0,0 +1,177 @@
+# --- Бенчмарки пайплайна на синтетических данных ---
+#
+# Запуск (из корня репозитория, офлайн, на CPU):
+#   python -m benchmarks.run_benchmarks --slices 64 256 --output benchmarks/results/latest.json
+#
+# Флоу:
+# 1. Генерирует (или берет из --data-dir) синтетические ZIP-архивы всех форматов.
+# 2. Для каждого архива замеряет этапы: parse_zip_archive, полное декодирование объема,
+#    validate_series, prepare_frames_for_display, create_gif, подготовку срезов,
+#    run_inference с детерминированной заменой модели и end-to-end запрос к /process.
+# 3. Пишет JSON: время (min/median/mean по --repeats повторам) и пиковую память
+#    (tracemalloc, отдельным прогоном) для каждого замера.
+#
+# Сравнение двух прогонов: python -m benchmarks.compare old.json new.json
+
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# Кэш результатов инференса исказил бы замеры повторных прогонов
+os.environ["MEDSCREEN_CACHE_PATH"] = ""
+
+import numpy as np
+import requests
+
+from app.file_io import parse_zip_archive
+from app.data_validation import validate_series
+from app.study_inference import select_step, quartile_sample_indices
+from app.pages import CT_WINDOWS
+from app.visualization import prepare_frames_for_display, create_gif
+from benchmarks.stand_in import StandInClassifier
+from benchmarks.synthetic_data import FORMATS, generate_suite
+
+BENCHMARKS = ("parse", "decode", "validate", "display_frames", "gif", "prepare_slices", "inference", "process_endpoint")
+
+def _unwrap(func):
+    """Исходная функция без st.cache_data, чтобы каждый повтор действительно считал."""
+    return getattr(func, "__wrapped__", func)
+
+def measure(func, repeats: int) -> dict:
+    """Время по повторам и пиковая память отдельным прогоном под tracemalloc."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "time_s": {"min": min(times), "median": statistics.median(times), "mean": statistics.mean(times)},
+        "peak_mb": peak / 1024 ** 2,
+    }
+
+class _ApiServer:
+    """uvicorn с app.api в фоновом потоке; модель заменена детерминированной заглушкой."""
+
+    def __enter__(self):
+        import uvicorn
+        from app import api
+
+        api.model_state.model = StandInClassifier()
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self._server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        while not self._server.started:
+            time.sleep(0.05)
+        # Модель "загружается" в фоне: ждем готовности
+        while requests.get(f"http://127.0.0.1:{self.port}/health/ready").status_code != 200:
+            time.sleep(0.05)
+        return self
+
+    def post_process(self, path: str) -> dict:
+        with open(path, "rb") as f:
+            response = requests.post(
+                f"http://127.0.0.1:{self.port}/process",
+                files={"files": (os.path.basename(path), f, "application/zip")}
+            )
+        response.raise_for_status()
+        return response.json()
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join()
+
+def _prepare_sampled(classifier, slices):
+    """Подготовка выбранных срезов, как в run_inference: рамка тела и кадрирование входят в замер."""
+    return classifier._prepare_slices(slices, classifier._study_bbox(slices))
+
+def run_suite(paths: dict, benchmarks, repeats: int, server) -> list:
+    classifier = StandInClassifier()
+    prepare_frames = _unwrap(prepare_frames_for_display)
+    make_gif = _unwrap(create_gif)
+    results = []
+
+    for (fmt, num_slices), path in sorted(paths.items()):
+        data, error_message = parse_zip_archive(path)
+        if error_message:
+            raise RuntimeError(f"{path}: {error_message}")
+        series_data = next(iter(data.values()))
+        window_name = next(iter(CT_WINDOWS)) if series_data["meta"].get("Modality") == "CT" else "Default"
+        display_frames = prepare_frames(series_data, series_data["fingerprint"], window_name, CT_WINDOWS)
+        sampled = quartile_sample_indices(num_slices, select_step(num_slices))
+
+        cases = {
+            "parse": lambda: parse_zip_archive(path),
+            "decode": lambda: np.asarray(parse_zip_archive(path)[0][next(iter(data))]["frames"]),
+            "validate": lambda: validate_series(series_data["meta"]),
+            "display_frames": lambda: prepare_frames(series_data, series_data["fingerprint"], window_name, CT_WINDOWS),
+            "gif": lambda: make_gif(display_frames),
+            "prepare_slices": lambda: _prepare_sampled(classifier, series_data["frames"][sampled]),
+            "inference": lambda: classifier.run_inference(series_data["frames"]),
+            "process_endpoint": lambda: server.post_process(path),
+        }
+        for name in benchmarks:
+            result = measure(cases[name], repeats)
+            results.append({"benchmark": name, "format": fmt, "num_slices": num_slices, **result})
+            print(f"{name:>16} {fmt:>16} {num_slices:>5} slices: "
+                  f"{result['time_s']['median'] * 1000:9.1f} ms, peak {result['peak_mb']:8.1f} MB", flush=True)
+    return results
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарки MedScreen на синтетических исследованиях.")
+    parser.add_argument("--slices", type=int, nargs="+", default=[64, 256], help="Число срезов в исследованиях")
+    parser.add_argument("--size", type=int, default=512, help="Размер среза (пиксели)")
+    parser.add_argument("--formats", nargs="+", choices=FORMATS, default=list(FORMATS))
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument("--repeats", type=int, default=3, help="Повторов на замер времени")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "medscreen-bench"),
+                        help="Каталог для синтетических архивов (переиспользуются между запусками)")
+    parser.add_argument("--output", default="benchmarks/results/latest.json", help="Файл с результатами (JSON)")
+    args = parser.parse_args(argv)
+
+    paths = generate_suite(args.data_dir, args.slices, args.formats, args.size)
+
+    if "process_endpoint" in args.benchmarks:
+        with _ApiServer() as server:
+            results = run_suite(paths, args.benchmarks, args.repeats, server)
+    else:
+        results = run_suite(paths, args.benchmarks, args.repeats, None)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "size": args.size,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Результаты записаны в {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+# --- Детерминированная замена классификатора для бенчмарков ---
+#
+# `StandInClassifier` проходит тот же путь, что и PathologyClassifier.run_inference (общий `StudyInference`)
+# (выборка срезов, подготовка, агрегация), но вместо модели оценивает срез
+# по доле ярких пикселей. Веса не загружаются, GPU и сеть не нужны.
+
+import threading
+from typing import Any, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from app.study_inference import StudyInference, BATCH_SIZE, EARLY_EXIT, DEDUP_TOLERANCE
+
+class StandInClassifier(StudyInference):
+    """Классификатор без модели: детерминированная оценка по изображению среза."""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, early_exit: bool = EARLY_EXIT,
+                 dedup_tolerance: float = DEDUP_TOLERANCE):
+        super().__init__(batch_size=batch_size, aggregation="vote", early_exit=early_exit,
+                         dedup_tolerance=dedup_tolerance)
+        self.model_name = "stand-in"
+        self._model_lock = threading.Lock()
+
+    @property
+    def model_signature(self) -> Dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def warm_up(self) -> None:
+        pass
+
+    def _predict_batch(self, images: List[Image.Image]) -> List[float]:
+        # Доля пикселей ярче середины диапазона: стабильна и зависит от содержимого
+        return [float((np.asarray(image) > 128).mean()) for image in images]
@@ -0,0 +1,118 @@
+# --- Генератор синтетических исследований для бенчмарков ---
+#
+# Создает ZIP-архивы во всех поддерживаемых форматах из одного и того же
+# синтетического "фантома" грудной клетки (воздух, тело, два легких, шум):
+#   - "dicom_series": серия однокадровых DICOM (int16 HU через RescaleIntercept)
+#   - "dicom_multiframe": один многокадровый DICOM
+#   - "nifti": один .nii.gz
+#   - "png_series": серия PNG (уже в легочном окне, uint8)
+#
+# Генерация детерминирована (seed), сеть не нужна.
+
+import gzip
+import io
+import os
+import zipfile
+import numpy as np
+import nibabel
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, CTImageStorage, generate_uid
+from PIL import Image
+
+FORMATS = ("dicom_series", "dicom_multiframe", "nifti", "png_series")
+
+def make_phantom(num_slices: int, size: int = 512, seed: int = 0) -> np.ndarray:
+    """Синтетический КТ-объем грудной клетки в HU (int16), форма (срезы, size, size)."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:size, 0:size] / size - 0.5
+    body = (xx / 0.42) ** 2 + (yy / 0.32) ** 2 <= 1
+    volume = np.full((num_slices, size, size), -1000, dtype=np.int16)
+    for z in range(num_slices):
+        # Легкие меняют размер вдоль оси, чтобы соседние срезы немного отличались
+        lung_scale = 0.6 + 0.4 * np.sin(np.pi * (z + 1) / (num_slices + 1))
+        lungs = (((np.abs(xx) - 0.18) / (0.13 * lung_scale)) ** 2 + (yy / (0.22 * lung_scale)) ** 2) <= 1
+        frame = volume[z]
+        frame[body] = 40
+        frame[body & lungs] = -850
+        frame += rng.normal(0, 20, (size, size)).astype(np.int16)
+    return volume
+
+def _dicom_dataset(series_uid: str, study_uid: str, rows: int, columns: int) -> Dataset:
+    file_meta = FileMetaDataset()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    file_meta.MediaStorageSOPClassUID = CTImageStorage
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = series_uid
+    ds.StudyInstanceUID = study_uid
+    ds.Modality = "CT"
+    ds.BodyPartExamined = "CHEST"
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    ds.PixelSpacing = [0.7, 0.7]
+    ds.SliceThickness = 1.0
+    ds.RescaleSlope = 1
+    ds.RescaleIntercept = -1024
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 12
+    ds.HighBit = 11
+    ds.PixelRepresentation = 0
+    ds.Rows, ds.Columns = rows, columns
+    return ds
+
+def _dicom_bytes(ds: Dataset) -> bytes:
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+def _stored_values(volume_hu: np.ndarray) -> np.ndarray:
+    # Хранимые значения без знака: HU = stored - 1024
+    return np.clip(volume_hu.astype(np.int32) + 1024, 0, 4095).astype(np.uint16)
+
+def write_study_zip(path: str, fmt: str, num_slices: int, size: int = 512, seed: int = 0) -> str:
+    """Записывает синтетическое исследование в формате fmt в ZIP-архив по пути path."""
+    volume = make_phantom(num_slices, size, seed)
+    series_uid, study_uid = generate_uid(), generate_uid()
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        if fmt == "dicom_series":
+            stored = _stored_values(volume)
+            for z in range(num_slices):
+                ds = _dicom_dataset(series_uid, study_uid, size, size)
+                ds.InstanceNumber = z + 1
+                ds.PixelData = stored[z].tobytes()
+                zf.writestr(f"series/IM{z:05d}", _dicom_bytes(ds))
+        elif fmt == "dicom_multiframe":
+            ds = _dicom_dataset(series_uid, study_uid, size, size)
+            ds.NumberOfFrames = num_slices
+            ds.PixelData = _stored_values(volume).tobytes()
+            zf.writestr("study.dcm", _dicom_bytes(ds))
+        elif fmt == "nifti":
+            # file_io ожидает оси (x, y, z) в RAS и сам переставляет их в (срезы, высота, ширина)
+            nii_img = nibabel.Nifti1Image(np.transpose(volume, (2, 1, 0)), np.eye(4))
+            zf.writestr("study.nii.gz", gzip.compress(nii_img.to_bytes(), compresslevel=1))
+        elif fmt == "png_series":
+            lo, hi = -1350, 150
+            frames = ((np.clip(volume, lo, hi) - lo) * (255 / (hi - lo))).astype(np.uint8)
+            for z in range(num_slices):
+                buffer = io.BytesIO()
+                Image.fromarray(frames[z]).save(buffer, format="PNG")
+                zf.writestr(f"images/{z:05d}.png", buffer.getvalue())
+        else:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+    return path
+
+def generate_suite(output_dir: str, slice_counts, formats=FORMATS, size: int = 512, seed: int = 0) -> dict:
+    """Генерирует набор архивов {(формат, число срезов): путь} в output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for fmt in formats:
+        for num_slices in slice_counts:
+            path = os.path.join(output_dir, f"{fmt}_{num_slices}_{size}.zip")
+            if not os.path.exists(path):
+                write_study_zip(path, fmt, num_slices, size, seed)
+            paths[(fmt, num_slices)] = path
+    return paths
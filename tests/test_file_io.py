@@ -0,0 +1,75 @@
+import io
+import zipfile
+
+import nibabel
+import numpy as np
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, CTImageStorage, generate_uid
+
+from app.file_io import parse_zip_archive
+
+def _dicom_slice(pixels: np.ndarray, series_uid: str, instance: int, **tags) -> bytes:
+    file_meta = FileMetaDataset()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    file_meta.MediaStorageSOPClassUID = CTImageStorage
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    ds = Dataset()
+    ds.file_meta = file_meta
+    ds.SOPClassUID = CTImageStorage
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = series_uid
+    ds.InstanceNumber = instance
+    ds.Modality = "CT"
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.Rows, ds.Columns = pixels.shape
+    for name, value in tags.items():
+        setattr(ds, name, value)
+    ds.PixelData = pixels.tobytes()
+    buffer = io.BytesIO()
+    ds.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+def _dicom_series_zip(volume: np.ndarray, **tags) -> bytes:
+    series_uid = generate_uid()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for index, pixels in enumerate(volume):
+            zf.writestr(f"series/IM{index:05d}", _dicom_slice(pixels, series_uid, index + 1, **tags))
+    return buffer.getvalue()
+
+def _single_series(archive: bytes):
+    data, error_message = parse_zip_archive(archive)
+    assert error_message is None
+    (series,) = data.values()
+    return np.asarray(series["frames"])
+
+def test_unsigned_dicom_series_above_int16_keeps_values():
+    volume = np.full((3, 8, 8), 1000, dtype=np.uint16)
+    volume[1, 2, 3] = 50000
+    frames = _single_series(_dicom_series_zip(
+        volume, BitsStored=16, HighBit=15, PixelRepresentation=0, RescaleSlope=1, RescaleIntercept=0
+    ))
+    assert frames.max() == 50000
+    np.testing.assert_array_equal(frames, volume)
+
+def test_ct_series_with_integer_rescale_is_int16_hu():
+    volume = np.full((3, 8, 8), 24, dtype=np.uint16)
+    volume[0, 0, 0] = 4095
+    frames = _single_series(_dicom_series_zip(
+        volume, BitsStored=12, HighBit=11, PixelRepresentation=0, RescaleSlope=1, RescaleIntercept=-1024
+    ))
+    assert frames.dtype == np.int16
+    assert frames.min() == -1000 and frames.max() == 3071
+
+def test_uint16_nifti_above_int16_keeps_values():
+    volume = np.full((8, 8, 3), 100, dtype=np.uint16)
+    volume[4, 4, 1] = 64900
+    image = nibabel.Nifti1Image(volume, np.eye(4))
+    image.set_data_dtype(np.uint16)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.writestr("study.nii", image.to_bytes())
+    frames = _single_series(buffer.getvalue())
+    assert frames.max() == 64900
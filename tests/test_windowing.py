@@ -0,0 +1,40 @@
+import numpy as np
+
+from app.windowing import window_to_uint8, minmax_to_uint8
+
+ALL_INT16 = np.arange(-32768, 32768, dtype=np.int64).astype(np.int16)
+
+def _display_formula(volume: np.ndarray, center: float, width: float) -> np.ndarray:
+    """Прежнее окно визуализации: float32-буфер и операции на месте."""
+    lo, hi = center - width / 2, center + width / 2
+    scaled = volume.astype(np.float32)
+    np.clip(scaled, lo, hi, out=scaled)
+    scaled -= lo
+    scaled /= (hi - lo + 1e-6)
+    return (np.clip(scaled, 0, 1) * 255).astype(np.uint8)
+
+def _model_formula(volume: np.ndarray, center: float, width: float) -> np.ndarray:
+    """Прежняя подготовка среза для модели (int16 numpy приводит к float64)."""
+    lo, hi = center - width / 2, center + width / 2
+    scaled = np.clip(volume, lo, hi)
+    scaled = (scaled - lo) / (hi - lo + 1e-6)
+    return (np.clip(scaled, 0, 1) * 255).astype(np.uint8)
+
+def test_display_window_matches_float32_formula_on_all_int16():
+    for center, width in [(-600, 1500), (40, 400), (700, 1500)]:
+        np.testing.assert_array_equal(window_to_uint8(ALL_INT16, center, width), _display_formula(ALL_INT16, center, width))
+
+def test_model_window_matches_previous_formula_on_all_int16():
+    np.testing.assert_array_equal(
+        window_to_uint8(ALL_INT16, -600, 1500, precision=np.float64), _model_formula(ALL_INT16, -600, 1500)
+    )
+
+def test_float_volume_matches_float32_formula():
+    volume = np.linspace(-2000, 2000, 10001, dtype=np.float32)
+    np.testing.assert_array_equal(window_to_uint8(volume, -600, 1500), _display_formula(volume, -600, 1500))
+
+def test_minmax_keeps_full_uint8_range():
+    volume = np.arange(256, dtype=np.uint8)
+    result = minmax_to_uint8(volume)
+    assert result[0] == 0 and result[-1] == 255
+    np.testing.assert_array_equal(result, _display_formula(volume, 127.5, 255))